@@ -1,3 +1,4 @@
+import asyncio
 from abc import ABC, abstractmethod
 
 from typing import TypeVar, Generic
@@ -22,3 +23,12 @@ class Agent(Generic[OutputType], ABC):
     def run(self, prompt_input: InputType) -> OutputType:
         """Processes the structured input and returns a structured output."""
         pass
+
+    async def arun(self, prompt_input: InputType) -> OutputType:
+        """Async entry point for use inside an event loop.
+
+        The default offloads the synchronous `run` to a worker thread so a
+        blocking agent never stalls the loop or any concurrent agents.
+        Agents with a natively asynchronous implementation override this.
+        """
+        return await asyncio.to_thread(self.run, prompt_input)
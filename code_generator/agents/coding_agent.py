@@ -1,7 +1,37 @@
-from typing import List, Optional
+import difflib
+import hashlib
+import json
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
 from pydantic import BaseModel, Field
 from code_generator.agents.agent import Agent
-from ..sandbox import CodeFile
+from ..llm_interface import CodeFile, LLMInterface
+from ..prompting import compile_template, make_renderer, render_template
+
+# Shared prompt fragments. The initial and refinement preambles are composed
+# from these so the common text lives in one place and both preambles keep a
+# byte-identical core, which also maximizes the context-cache hit surface.
+_ROLE_BLOCK = "You are an expert Python developer."
+
+_QUALITY_BLOCK = """Make sure that all your code is properly tested, the functions must have type hints
+and proper docstrings. You have to be mindful of having a well structured code (i.e.
+no functions with excesive number of parameters, divide into classes, use OOP when needed,
+have interfaces if needed, split into modules if needed etc). Your code must be DRY as well."""
+
+_TEST_BLOCK = """The testing must be complete and comprehensive. It is meant to cover all cases you can
+think of exhaustively (without exageration). No edge case must be left without testing,
+your code MUST work."""
+
+_COMMAND_BLOCK = """The code will be executed in a sandboxed environment, and a command will be run from
+the root of the workspace to test your code."""
+
+_DELTA_BLOCK = """The previous files are given as a delta: entries marked "unchanged" are byte-identical
+to the version from your previous answer; their content is omitted (only path and
+content hash are listed) and they are carried over for you automatically — do NOT
+include them in your answer unless you are changing them. Entries marked "new" carry
+their full content; entries marked "changed" carry a unified diff from the version you
+previously saw to the current one. Return every file you create or modify with its
+complete content."""
 
 
 class CodeAgentOutput(BaseModel):
@@ -27,6 +57,21 @@ class CodeAgentInput(BaseModel):
     execution_feedback: Optional[str] = Field(
         None, description="The stdout/stderr from the last failed run."
     )
+    file_scope: Optional[List[str]] = Field(
+        None,
+        description=(
+            "When set, the agent only (re)generates these files. Used to "
+            "shard independent file groups across concurrent calls."
+        ),
+    )
+    candidate_seed: Optional[int] = Field(
+        None,
+        description=(
+            "Sampling seed for this call. Concurrent candidate attempts "
+            "pass distinct seeds so identical prompts yield independent "
+            "samples instead of one repeated answer."
+        ),
+    )
 
 
 class CodeAgent(Agent[CodeAgentOutput]):
@@ -34,39 +79,36 @@ class CodeAgent(Agent[CodeAgentOutput]):
     An agent that generates or refines code by creating a prompt and calling an LLM.
     """
 
+    # Static preambles shared verbatim by every call. They are registered
+    # with the provider's context cache (see LLMInterface.ensure_prompt_cache)
+    # so their server-side KV cache is reused across turns; only the dynamic
+    # templates below are re-sent each call.
+    INITIAL_PROMPT_PREFIX = (
+        f"{_ROLE_BLOCK} Your task is to generate a set of Python files based on a prompt.\n\n"
+        f"{_QUALITY_BLOCK}\n\n"
+        f"{_TEST_BLOCK}\n\n"
+        f"{_COMMAND_BLOCK}\n"
+    )
+
     INITIAL_PROMPT_TEMPLATE = """
-    You are an expert Python developer. Your task is to generate a set of Python files based on the following prompt.
     Prompt: "{prompt}"
-    
-    Make sure that all your code is properly tested, the functions must have type hints
-    and proper docstrings. You have to be mindful of having a well structured code (i.e.
-    no functions with excesive number of parameters, divide into classes, use OOP when needed,
-    have interfaces if needed, split into modules if needed etc)
-    
-    The testing must be complete and comprehensive. It is meant to cover all cases you can
-    think of exhaustively (without exageration)
-
-    The code will be executed in a sandboxed environment, and the following command will be run from the root of the workspace to test your code:
+
     --- COMMAND ---
     {command}
     --- END COMMAND ---
     """
 
+    REFINEMENT_PROMPT_PREFIX = (
+        f"{_ROLE_BLOCK} Your previous attempt to write code had issues.\n\n"
+        f"{_QUALITY_BLOCK}\n\n"
+        f"{_TEST_BLOCK}\n\n"
+        f"{_DELTA_BLOCK}\n"
+    )
+
     REFINEMENT_PROMPT_TEMPLATE = """
-    You are an expert Python developer. Your previous attempt to write code had issues.
     Your original aim was: "{prompt}"
     The command used for execution was: "{command}"
-    
-    Make sure that all your code is properly tested, the functions must have type hints
-    and proper docstrings. You have to be mindful of having a well structured code (i.e.
-    no functions with excesive number of parameters, divide into classes, use OOP when needed,
-    have interfaces if needed, split into modules if needed etc). Your code must be DRY as well.
-    
-    The testing must be complete and comprehensive. It is meant to cover all cases you can
-    think of exhaustively (without exageration). No edge case must be left without testing,
-    your code MUST work.
-    
-    
+
     You previously generated the following files:
     --- PREVIOUS FILES ---
     {previous_files_json}
@@ -80,31 +122,200 @@ class CodeAgent(Agent[CodeAgentOutput]):
     Based on this feedback, please fix the code and provide a new, complete version of all the files.
     """
 
+    # Templates compiled once at class definition into (literal, slot)
+    # segments, so each render is a linear join instead of `str.format`
+    # re-scanning the whole template in the hot generation loop.
+    _INITIAL_COMPILED = compile_template(INITIAL_PROMPT_TEMPLATE)
+    _REFINEMENT_COMPILED = compile_template(REFINEMENT_PROMPT_TEMPLATE)
+
+    def __init__(self, llm_interface: LLMInterface):
+        super().__init__(llm_interface)
+        # Each template specialized into a positional closure, so the hot
+        # path in `run` substitutes slots without building a kwargs dict or
+        # selecting a template per call.
+        self._render_initial = make_renderer(
+            self.INITIAL_PROMPT_TEMPLATE, ["prompt", "command"]
+        )
+        self._render_refinement = make_renderer(
+            self.REFINEMENT_PROMPT_TEMPLATE,
+            ["prompt", "command", "previous_files_json", "execution_feedback"],
+        )
+        # Content hashes and contents of the files last embedded in a
+        # refinement prompt, keyed by relative path. Used to transmit only
+        # deltas (hash markers / diffs) and avoid quadratic token growth
+        # over refinement iterations. The agent must therefore be long-lived:
+        # the driver keeps one instance per run rather than constructing a
+        # fresh agent per call, which would reset the baseline every time.
+        self._last_sent_hashes: Dict[str, str] = {}
+        self._last_sent_contents: Dict[str, str] = {}
+        # The most recently rendered result, committed to the baseline only
+        # when a *different* result arrives. Multi-action steps render the
+        # same previous result several times; committing eagerly would make
+        # every render after the first see its own files as "unchanged"
+        # markers whose content no prompt in that step ever carried.
+        self._pending_hashes: Optional[Dict[str, str]] = None
+        self._pending_contents: Optional[Dict[str, str]] = None
+        # Guards the last-sent state: prompt construction may be invoked from
+        # concurrent driver threads (parallel orchestrator actions).
+        self._delta_lock = Lock()
+
+    def _build_files_delta(
+        self,
+        previous_result: CodeAgentOutput,
+        file_scope: Optional[List[str]] = None,
+    ) -> str:
+        """
+        Serializes the previous files as a delta against what was last sent.
+
+        Files whose content hash matches the previously transmitted version
+        are reduced to a path + hash marker; changed files carry a unified
+        diff against the last transmitted version, and only new files carry
+        their full content. Files in `file_scope` always carry full content:
+        they are exactly the ones this call must regenerate, so a marker
+        would ask the model to rewrite code it cannot see.
+
+        The baseline is advanced per result, not per render: repeated
+        renders of the same result (multi-action steps, sharded parallel
+        actions) all see the identical delta against the previous step.
+        """
+        new_hashes: Dict[str, str] = {}
+        new_contents: Dict[str, str] = {}
+        for code_file in previous_result.files:
+            digest = hashlib.sha256(code_file.content.encode("utf-8")).hexdigest()
+            new_hashes[code_file.relative_path] = digest
+            new_contents[code_file.relative_path] = code_file.content
+        if self._pending_hashes is not None and new_hashes != self._pending_hashes:
+            # A new step's result: what the last step rendered becomes the
+            # baseline this delta is computed against.
+            self._last_sent_hashes = self._pending_hashes
+            self._last_sent_contents = self._pending_contents
+        self._pending_hashes = new_hashes
+        self._pending_contents = new_contents
+
+        scoped = set(file_scope or ())
+        delta = []
+        for code_file in previous_result.files:
+            digest = new_hashes[code_file.relative_path]
+            last_digest = self._last_sent_hashes.get(code_file.relative_path)
+            if code_file.relative_path in scoped or last_digest is None:
+                delta.append(
+                    {
+                        "relative_path": code_file.relative_path,
+                        "status": "new",
+                        "content": code_file.content,
+                    }
+                )
+            elif last_digest == digest:
+                delta.append(
+                    {
+                        "relative_path": code_file.relative_path,
+                        "sha256": digest,
+                        "status": "unchanged",
+                    }
+                )
+            else:
+                diff = "".join(
+                    difflib.unified_diff(
+                        self._last_sent_contents[code_file.relative_path].splitlines(
+                            keepends=True
+                        ),
+                        code_file.content.splitlines(keepends=True),
+                        fromfile=f"a/{code_file.relative_path}",
+                        tofile=f"b/{code_file.relative_path}",
+                    )
+                )
+                delta.append(
+                    {
+                        "relative_path": code_file.relative_path,
+                        "status": "changed",
+                        "diff": diff,
+                    }
+                )
+        return json.dumps(delta, indent=2)
+
     def get_prompt(self, is_refinement: bool, **kwargs) -> str:
-        """Selects and formats the appropriate prompt template."""
-        if is_refinement:
-            return self.REFINEMENT_PROMPT_TEMPLATE.format(**kwargs)
-        else:
-            return self.INITIAL_PROMPT_TEMPLATE.format(**kwargs)
+        """Selects and renders the appropriate prompt template."""
+        compiled = (
+            self._REFINEMENT_COMPILED if is_refinement else self._INITIAL_COMPILED
+        )
+        return render_template(compiled, kwargs)
 
-    def run(self, prompt_input: CodeAgentInput) -> CodeAgentOutput:
+    def build_parts(self, prompt_input: CodeAgentInput) -> Tuple[str, str, str]:
         """
-        Generates or refines code by processing the input, creating a prompt,
-        and calling the LLMInterface.
+        Builds the prompt body and its static preamble for one call.
+
+        Separated from `run` so drivers that fan the same input out over
+        several sampled candidates (see main._run_code_attempts) render the
+        prompt — and advance the files-delta baseline — exactly once, and so
+        cascade callers can attach the preamble per model tier.
+
+        Returns:
+            A (body, prefix, cache_key) triple: the rendered dynamic prompt
+            without the preamble, the static preamble text, and its
+            context-cache key for `ensure_prompt_cache`.
         """
         is_refinement = (
             prompt_input.previous_result is not None
             and prompt_input.execution_feedback is not None
         )
-        prompt_args = prompt_input.model_dump()
 
+        prefix = (
+            self.REFINEMENT_PROMPT_PREFIX if is_refinement else self.INITIAL_PROMPT_PREFIX
+        )
+        cache_key = "code_agent.refinement" if is_refinement else "code_agent.initial"
+
+        # Only the fields the templates reference are passed, positionally.
+        # A full model_dump() would also walk and serialize every file
+        # content in previous_result just to discard it.
         if is_refinement:
-            prompt_args["previous_files_json"] = (
-                prompt_input.previous_result.model_dump()
+            with self._delta_lock:
+                files_delta = self._build_files_delta(
+                    prompt_input.previous_result, prompt_input.file_scope
+                )
+            body = self._render_refinement(
+                prompt_input.prompt,
+                prompt_input.command,
+                files_delta,
+                prompt_input.execution_feedback,
             )
+        else:
+            body = self._render_initial(
+                prompt_input.prompt, prompt_input.command
+            )
+        if prompt_input.file_scope:
+            scope_list = "\n".join(f"    - {path}" for path in prompt_input.file_scope)
+            body += (
+                "\n    Restrict your changes to the following files and return ONLY"
+                "\n    them, each with its complete content. The remaining files are"
+                "\n    handled separately and must not appear in your answer:\n"
+                f"{scope_list}\n"
+            )
+        return body, prefix, cache_key
 
-        final_prompt = self.get_prompt(is_refinement, **prompt_args)
+    def build_call(self, prompt_input: CodeAgentInput) -> Tuple[str, Optional[str]]:
+        """
+        Builds the final prompt and cache handle for one generation call.
+
+        Returns:
+            A (final_prompt, cached_content) pair ready to be passed to
+            `LLMInterface.generate_json`; the preamble is inlined into the
+            prompt when no context-cache handle could be obtained.
+        """
+        body, prefix, cache_key = self.build_parts(prompt_input)
+        cached_content = self.llm_interface.ensure_prompt_cache(cache_key, prefix)
+        if cached_content is None:
+            body = prefix + body
+        return body, cached_content
 
+    def run(self, prompt_input: CodeAgentInput) -> CodeAgentOutput:
+        """
+        Generates or refines code by processing the input, creating a prompt,
+        and calling the LLMInterface.
+        """
+        final_prompt, cached_content = self.build_call(prompt_input)
         return self.llm_interface.generate_json(
-            prompt=final_prompt, response_model=CodeAgentOutput
+            prompt=final_prompt,
+            response_model=CodeAgentOutput,
+            cached_content=cached_content,
+            seed=prompt_input.candidate_seed,
         )
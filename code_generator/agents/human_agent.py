@@ -1,3 +1,5 @@
+import asyncio
+
 from pydantic import BaseModel
 from .agent import Agent
 
@@ -38,3 +40,16 @@ class HumanAgent(Agent[HumanOutput]):
         answer = input("> ")
         print("--- THANK YOU ---")
         return HumanOutput(answer=answer)
+
+    async def arun(self, prompt_input: HumanInput) -> HumanOutput:
+        """
+        Asks the question without blocking the event loop. The blocking
+        `input()` read runs on a worker thread, so concurrent agents (e.g.
+        in-flight LLM calls) keep making progress while waiting for the
+        human to answer.
+        """
+        print("\n--- HUMAN ASSISTANCE REQUIRED ---")
+        print(f"Question: {prompt_input.question}")
+        answer = await asyncio.to_thread(input, "> ")
+        print("--- THANK YOU ---")
+        return HumanOutput(answer=answer)
@@ -1,29 +1,50 @@
+import asyncio
+import functools
 import logging
-from typing import List, Dict, Any, Type, Literal
+from typing import List, Dict, Any, Type, Literal, Union
 from pydantic import BaseModel, Field
 
 from .agent import Agent
 from ..llm_interface import LLMInterface
+from ..prompting import compile_template, render_template
 from .coding_agent import CodeAgentInput
 from .human_agent import HumanInput
 
 
-class AgentSelection(BaseModel):
-    """The initial decision of which agent to use and why."""
+class FinishArgs(BaseModel):
+    """Arguments for the 'finish' action."""
+
+    reason: str = Field(..., description="The reason for finishing the task.")
+
+
+class ActionDecision(BaseModel):
+    """A single agent invocation within an orchestrator decision."""
 
     agent_name: Literal["code_agent", "human_agent", "finish"] = Field(
         ..., description="The name of the agent to be called."
     )
-    reasoning: str = Field(
+    args: Union[CodeAgentInput, HumanInput, FinishArgs] = Field(
         ...,
-        description="A detailed reasoning for choosing this agent and what you want it to accomplish.",
+        description="The arguments for the chosen agent, matching its input schema.",
     )
 
 
-class FinishArgs(BaseModel):
-    """Arguments for the 'finish' action."""
+class OrchestratorDecision(BaseModel):
+    """A structured decision: one or more agent invocations and the reasoning."""
 
-    reason: str = Field(..., description="The reason for finishing the task.")
+    reasoning: str = Field(
+        ...,
+        description="A detailed reasoning for the chosen action(s) and what you want them to accomplish.",
+    )
+    actions: List[ActionDecision] = Field(
+        ...,
+        min_length=1,
+        description="The agent invocations to perform. Usually a single action.",
+    )
+    parallel: bool = Field(
+        False,
+        description="True only when the actions are independent of each other and may run concurrently.",
+    )
 
 
 class OrchestratorInput(BaseModel):
@@ -34,19 +55,57 @@ class OrchestratorInput(BaseModel):
 
 
 class OrchestratorOutput(BaseModel):
-    """The final output of the orchestrator, specifying the next agent and its arguments."""
+    """A single agent invocation, specifying the agent and its arguments."""
 
     agent_name: str
     args: Dict[str, Any]
 
 
-class OrchestratorAgent(Agent[OrchestratorOutput]):
-    AGENT_SELECTION_PROMPT_TEMPLATE = """
+class OrchestratorOutputBatch(BaseModel):
+    """The final output of the orchestrator: one or more agent invocations.
+
+    When `parallel` is True the actions are independent and the driver may
+    execute them concurrently, collapsing their latency to the slowest one.
+    """
+
+    actions: List[OrchestratorOutput]
+    parallel: bool = False
+
+
+class OrchestratorAgent(Agent[OrchestratorOutputBatch]):
+    # Static preamble shared verbatim by every call. It is registered with
+    # the provider's context cache (see LLMInterface.ensure_prompt_cache)
+    # so only the dynamic template below is re-sent each step.
+    DECISION_PROMPT_PREFIX = """
 You are an orchestrator agent. Your goal is to solve a programming task by coordinating other agents.
-Based on the user's objective and the history of actions, you will first decide which single agent to call next.
+Based on the user's objective and the history of actions, you will decide which agent(s) to call next.
+
+In one pass you must produce: a detailed reasoning for your choice, and a list of actions, each
+naming an agent and the JSON arguments for it matching its input schema. Usually you will emit
+exactly ONE action. Only when several code_agent tasks are truly independent of each other (e.g.
+they touch unrelated modules) may you emit them together and set parallel to true; independent
+actions will then be executed concurrently.
 
-IMPORTANT: Your decision and reasoning will be passed to a separate argument-generating AI. Therefore, your 'reasoning' must be a clear and direct instruction for the task you want the selected agent to perform.
+Special Instructions for code_agent:
+You must give the agent instructions! You do not need to write explicitly code in the prompt
+unless you have a particular request. But you MUST give detailed instructions! Understand the
+coding agent wont have all the context you do so you must provide it for him. ALL it needs
+to know you must give (general aim, and his task). He will have access to current code, if there
+is one.
+
+For code_agent, the command field is an optional, additional shell command: if non-empty it is
+appended with ' && ' to the base command that installs dependencies and runs pytest. Use it to
+run a specific part of the code (like a CLI) after the tests; otherwise provide an empty string "".
+DO NOT add && to the start or end of your command string.
+
+When a step touches several independent parts of the codebase, you may shard it: emit several
+parallel code_agent actions, each with file_scope set to the group of files it owns. Scopes must
+be disjoint and the groups truly independent (no cross-group imports among the regenerated
+files); files outside every scope are carried over unchanged. Leave file_scope unset for
+ordinary, whole-codebase changes.
+"""
 
+    DECISION_PROMPT_TEMPLATE = """
 Your available agents (tools) are:
 --- AVAILABLE TOOLS ---
 {available_tools}
@@ -62,64 +121,30 @@ Here is the history of actions taken so far:
 {history}
 --- END HISTORY ---
 
-First, decide which agent to call and provide a clear, actionable reasoning for your choice.
-You MUST choose one of the available agents. Your output must be a JSON object matching the AgentSelection schema.
+Decide which agent to call, provide a clear reasoning for your choice, and generate the
+arguments for that agent. You MUST choose one of the available agents. Your output must be
+a JSON object matching the OrchestratorDecision schema.
 """
 
-    ARGUMENT_GENERATION_PROMPT_TEMPLATE = """
-You are an argument generation assistant for a multi-agent system.
-Your task is to create the JSON arguments for the {agent_name} agent based on the orchestrator's reasoning.
-
-The original objective was: "{objective}"
-
-Here is the history of actions taken so far:
---- HISTORY ---
-{history}
---- END HISTORY ---
-
-The orchestrator chose to call the {agent_name} agent for the following reason:
---- REASONING ---
-{reasoning}
---- END REASONING ---
-
-Special Instructions for code_agent:
-You must give the agent instructions! You do not need to write explicitly code in the prompt
-unless you have a particular request. But you MUST give detailed instructions! Understand the
-coding agent wont have all the context you do so you must provide it for him. ALL it needs
-to know you must give (general aim, and his task). He will have access to current code, if there
-is one.
-
-If you are generating arguments for the code_agent, understand that the command you provide is an optional, additional command. 
-The system uses the following Python logic to construct the final command that gets executed:
-
-# This is the base command that always runs. It includes dependency installation and testing.
-EXECUTION_COMMAND = (
-    "python3 -m venv .venv && "
-    ". .venv/bin/activate && "
-    "uv pip install --no-cache -r requirements.txt && "
-    "uv pip install --no-cache -q pytest && "
-    "pytest -p no:cacheprovider -v"
-)
-
-# Your generated command (from agent_args["command"]) is appended if you provide one.
-if len(agent_args["command"]) > 0:
-    final_command = EXECUTION_COMMAND + " && " + agent_args["command"]
-else:
-    final_command = EXECUTION_COMMAND
-
-    Your task is to generate the prompt for the coding agent and, if needed, the additional command string to be appended.
-    The command is useful for running a specific part of the code (like a CLI) after the main tests have already run as part of EXECUTION_COMMAND.
-    If no additional command is needed, you must still generate the prompt but provide an empty string "" for the command.
-    DO NOT add && to the start or end of your command string.
-
-Based on the reasoning, generate the JSON arguments for the code_agent. Your output MUST be a valid JSON object.
-"""
+    # Template compiled once at class definition into (literal, slot)
+    # segments, so each orchestration step renders with a linear join
+    # instead of `str.format` re-scanning the whole template.
+    _DECISION_COMPILED = compile_template(DECISION_PROMPT_TEMPLATE)
+    _render_decision = staticmethod(
+        functools.partial(render_template, _DECISION_COMPILED)
+    )
 
     def __init__(self, llm_interface: LLMInterface, available_tools: Dict[str, str]):
         super().__init__(llm_interface)
         if not available_tools:
             raise ValueError("OrchestratorAgent requires at least one available tool.")
         self.available_tools = available_tools
+        # The tool list never changes after construction, so render it once
+        # instead of rebuilding the same string on every orchestration step.
+        self._tools_list_str = "\n".join(
+            f"- `{name}`: {description}"
+            for name, description in available_tools.items()
+        )
         self.tool_to_model_map: Dict[str, Type[BaseModel]] = {
             "code_agent": CodeAgentInput,
             "human_agent": HumanInput,
@@ -127,57 +152,81 @@ Based on the reasoning, generate the JSON arguments for the code_agent. Your out
         }
 
     def _generate_tools_list(self) -> str:
-        """Dynamically generates the list of tools for the prompt."""
-        tool_descriptions = []
-        for name, description in self.available_tools.items():
-            tool_descriptions.append(f"- `{name}`: {description}")
-        return "\n".join(tool_descriptions)
-
-    def run(self, prompt_input: OrchestratorInput) -> OrchestratorOutput:
+        """Returns the tool list rendered once at construction time."""
+        return self._tools_list_str
+
+    def run(self, prompt_input: OrchestratorInput) -> OrchestratorOutputBatch:
+        """Synchronous shim around `arun` for callers without an event loop."""
+        return asyncio.run(self.arun(prompt_input))
+
+    async def arun(self, prompt_input: OrchestratorInput) -> OrchestratorOutputBatch:
+        """
+        Decides on the next agent and generates its arguments in one LLM call.
+
+        The model already has all the context needed for both the selection
+        and the arguments, so collapsing the former two round-trips into a
+        single structured call halves the fixed time-to-first-token cost per
+        orchestration step. Instances are not coroutine-safe; create one
+        orchestrator per concurrent objective.
+        """
         history_str = (
             "\n".join(prompt_input.history)
             if prompt_input.history
             else "No actions taken yet."
         )
-        tools_list_str = self._generate_tools_list()
-
-        # --- Step 1: Decide which agent to call ---
-        logging.info("Orchestrator: Step 1 - Selecting agent...")
-        selection_prompt = self.AGENT_SELECTION_PROMPT_TEMPLATE.format(
-            available_tools=tools_list_str,
-            objective=prompt_input.objective,
-            history=history_str,
-        )
-        agent_selection = self.llm_interface.generate_json(
-            prompt=selection_prompt, response_model=AgentSelection
+        tools_list_str = self._tools_list_str
+
+        logging.info("Orchestrator: Selecting agent and generating arguments...")
+        decision_cache = self.llm_interface.ensure_prompt_cache(
+            "orchestrator.decision", self.DECISION_PROMPT_PREFIX
         )
-        selected_agent_name = agent_selection.agent_name
-        reasoning = agent_selection.reasoning
-        logging.info(
-            f"Orchestrator selected agent: '{selected_agent_name}' with reasoning: '{reasoning}'"
+        decision_prompt = self._render_decision(
+            {
+                "available_tools": tools_list_str,
+                "objective": prompt_input.objective,
+                "history": history_str,
+            }
         )
+        if decision_cache is None:
+            decision_prompt = self.DECISION_PROMPT_PREFIX + decision_prompt
 
-        # --- Step 2: Generate the arguments for the chosen agent ---
-        logging.info(
-            f"Orchestrator: Step 2 - Generating arguments for '{selected_agent_name}'..."
+        decision = await self.llm_interface.agenerate_json(
+            prompt=decision_prompt,
+            response_model=OrchestratorDecision,
+            cached_content=decision_cache,
         )
-        argument_model = self.tool_to_model_map.get(selected_agent_name)
-        if not argument_model:
-            raise ValueError(
-                f"No argument model found for agent: {selected_agent_name}"
-            )
-
-        args_prompt = self.ARGUMENT_GENERATION_PROMPT_TEMPLATE.format(
-            agent_name=selected_agent_name,
-            objective=prompt_input.objective,
-            reasoning=reasoning,
-            history=history_str,
+        logging.info(
+            f"Orchestrator selected action(s): "
+            f"{[action.agent_name for action in decision.actions]} "
+            f"(parallel={decision.parallel}) with reasoning: '{decision.reasoning}'"
         )
 
-        generated_args_model = self.llm_interface.generate_json(
-            prompt=args_prompt, response_model=argument_model
-        )
-        generated_args = generated_args_model.model_dump()
-        logging.info(f"Orchestrator generated arguments: {generated_args}")
+        outputs: List[OrchestratorOutput] = []
+        for action in decision.actions:
+            expected_model = self.tool_to_model_map[action.agent_name]
+            args = action.args
+            if not isinstance(args, expected_model):
+                # The union parsed into the wrong member. For 'finish' and
+                # 'human_agent' the reasoning already contains everything
+                # their single-field schemas need, so derive the args
+                # directly instead of spending another LLM round-trip (or
+                # failing validation).
+                if action.agent_name == "finish":
+                    args = FinishArgs(reason=decision.reasoning)
+                elif action.agent_name == "human_agent":
+                    args = HumanInput(question=decision.reasoning)
+                else:
+                    args = expected_model.model_validate(args.model_dump())
+
+            generated_args = args.model_dump()
+            logging.info(
+                f"Orchestrator generated arguments for '{action.agent_name}': "
+                f"{generated_args}"
+            )
+            outputs.append(
+                OrchestratorOutput(agent_name=action.agent_name, args=generated_args)
+            )
 
-        return OrchestratorOutput(agent_name=selected_agent_name, args=generated_args)
+        # Parallelism only applies to multiple independent actions.
+        parallel = decision.parallel and len(outputs) > 1
+        return OrchestratorOutputBatch(actions=outputs, parallel=parallel)
@@ -0,0 +1,128 @@
+import logging
+from typing import List
+
+from pydantic import BaseModel, Field
+
+from code_generator.llm_interface import LLMInterface
+
+logger = logging.getLogger(__name__)
+
+# Execution feedback is capped to this many bytes before it is embedded in
+# prompts. The cap is tail-biased: pytest puts the failing assertions and
+# tracebacks at the end of its output, so the tail carries the signal. A
+# small head slice is kept too — the first lines name the command, the
+# collection errors and the earliest failure, which the tail can miss on
+# very long runs.
+MAX_FEEDBACK_BYTES = 16_384
+MAX_FEEDBACK_HEAD_BYTES = 2_048
+
+
+def truncate_feedback(
+    feedback: str,
+    max_bytes: int = MAX_FEEDBACK_BYTES,
+    head_bytes: int = MAX_FEEDBACK_HEAD_BYTES,
+) -> str:
+    """Caps execution feedback to a head slice plus its tail.
+
+    Args:
+        feedback: The raw stdout/stderr feedback text.
+        max_bytes: The maximum number of UTF-8 bytes to keep in total.
+        head_bytes: How many of those bytes come from the start of the
+            output; the rest come from its end.
+
+    Returns:
+        The feedback, with the middle elided when over the limit and a
+        marker noting how much was dropped.
+    """
+    encoded = feedback.encode("utf-8")
+    if len(encoded) <= max_bytes:
+        return feedback
+    head = encoded[:head_bytes].decode("utf-8", errors="ignore")
+    tail_bytes = max_bytes - head_bytes
+    tail = encoded[-tail_bytes:].decode("utf-8", errors="ignore")
+    dropped = len(encoded) - head_bytes - tail_bytes
+    return f"{head}\n[... {dropped} bytes truncated ...]\n{tail}"
+
+
+class HistorySummary(BaseModel):
+    """Structured output for the history summarization call."""
+
+    summary: str = Field(
+        ...,
+        description=(
+            "A concise digest of the given events preserving actions taken, "
+            "their outcomes, key decisions and unresolved errors."
+        ),
+    )
+
+
+class HistoryCompactor:
+    """
+    Keeps the orchestrator's history context bounded as a run grows.
+
+    Without compaction every step re-sends the full, monotonically growing
+    history, making prefill cost superlinear in loop count. The compactor
+    passes the most recent entries through verbatim and rolls older entries
+    into an LLM-generated digest. Summarization only fires once `window` new
+    events have accumulated beyond the verbatim window, so it costs one
+    small LLM call per `window` events rather than one per step.
+    """
+
+    SUMMARY_PROMPT_TEMPLATE = """
+You maintain the memory of an agentic coding run. Fold the new events into the digest.
+Preserve: the actions taken, their outcomes, key decisions, and any unresolved errors.
+Be terse; drop file contents and repeated details.
+
+--- PREVIOUS DIGEST ---
+{previous_summary}
+--- END PREVIOUS DIGEST ---
+
+--- NEW EVENTS ---
+{events}
+--- END NEW EVENTS ---
+"""
+
+    def __init__(self, llm_interface: LLMInterface, window: int = 5):
+        self.llm_interface = llm_interface
+        self.window = window
+        self._summary = ""
+        # Number of leading history entries already folded into the digest.
+        self._summarized_count = 0
+
+    def compact(self, history: List[str]) -> List[str]:
+        """Returns a bounded view of `history`.
+
+        The view is the digest of older events (when one exists) followed by
+        the not-yet-summarized entries verbatim. The input list is never
+        mutated, so the full history stays available for checkpointing.
+        """
+        unsummarized = len(history) - self._summarized_count
+        if unsummarized >= 2 * self.window:
+            cutoff = len(history) - self.window
+            self._refresh_summary(history[self._summarized_count : cutoff])
+            self._summarized_count = cutoff
+
+        view: List[str] = []
+        if self._summary:
+            view.append(f"Digest of earlier events:\n{self._summary}")
+        view.extend(history[self._summarized_count :])
+        return view
+
+    def _refresh_summary(self, events: List[str]) -> None:
+        """Folds `events` into the running digest via one LLM call."""
+        logger.info(f"Compacting {len(events)} history entries into the digest.")
+        prompt = self.SUMMARY_PROMPT_TEMPLATE.format(
+            previous_summary=self._summary or "Empty.",
+            events="\n".join(events),
+        )
+        try:
+            result = self.llm_interface.generate_json(
+                prompt=prompt, response_model=HistorySummary
+            )
+            self._summary = result.summary
+        except Exception as e:
+            # A failed summarization must not lose context entirely: fall
+            # back to appending the first line of each event to the digest.
+            logger.warning(f"History summarization failed ({e}); using headlines.")
+            headlines = "\n".join(event.splitlines()[0] for event in events if event)
+            self._summary = f"{self._summary}\n{headlines}".strip()
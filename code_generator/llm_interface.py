@@ -1,22 +1,280 @@
+import asyncio
+import functools
 import os
 import logging
-import json
+import random
 import time
+from threading import Lock
 from google import genai
 import google.genai.errors as genai_errors
-from typing import TypeVar, Type
-from pydantic import BaseModel
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar, Type
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, create_model
+
+from code_generator.prompt_cache import DEFAULT_CACHE_DIR, PromptCache
+from code_generator.response_cache import StructuralResponseCache
+from code_generator.semantic_cache import SemanticCache
 
 T = TypeVar("T", bound=BaseModel)
 
 logger = logging.getLogger(__name__)
 
 
+class CodeFile(BaseModel):
+    relative_path: str = Field(
+        ..., description="The path of the file relative to the workspace root."
+    )
+    content: str = Field(
+        ..., description="The full source code or text content of the file."
+    )
+
+    @functools.cached_property
+    def content_bytes(self) -> bytes:
+        """The UTF-8 encoding of `content`, computed once per instance.
+
+        The same file content is written to a workspace (and hashed) on
+        every execution attempt; caching the encoding avoids re-encoding
+        large sources each time.
+        """
+        return self.content.encode("utf-8")
+
+
+@functools.lru_cache(maxsize=None)
+def _adapter(response_model: Type[BaseModel]) -> TypeAdapter:
+    """Returns a cached TypeAdapter so the schema/validator for a response
+    model is only built once per process instead of on every LLM call."""
+    return TypeAdapter(response_model)
+
+
+_BATCH_PROMPT_HEADER = """
+You will be given {n} independent tasks, each delimited below. Answer every task
+separately and in order. Your output must be a JSON object with a "results" array
+of exactly {n} elements, where element i is the complete answer to task i.
+"""
+
+
+@functools.lru_cache(maxsize=None)
+def _batch_model(response_model: Type[BaseModel]) -> Type[BaseModel]:
+    """Returns a cached wrapper model holding a list of `response_model`."""
+    return create_model(
+        f"{response_model.__name__}Batch",
+        results=(
+            List[response_model],
+            Field(..., description="One result per task, in task order."),
+        ),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _response_config(response_model: Type[BaseModel]) -> Dict:
+    """Returns the base generation config for a response model.
+
+    Passing the Pydantic class as `response_schema` makes the SDK re-derive
+    the schema on every request; deriving the JSON schema once through the
+    cached adapter and sending it as `response_json_schema` removes that
+    per-call cost. Callers must copy the dict before mutating it.
+    """
+    return {
+        "response_mime_type": "application/json",
+        "response_json_schema": _adapter(response_model).json_schema(),
+    }
+
+
+def _is_retryable(error: genai_errors.APIError) -> bool:
+    """Transient conditions (5xx, 429 quota) are retried; other client
+    errors (bad request, auth) will fail identically and are not."""
+    if isinstance(error, genai_errors.ServerError):
+        return True
+    return getattr(error, "code", None) == 429
+
+
+def _suggested_retry_delay(error: genai_errors.APIError) -> Optional[float]:
+    """Best-effort extraction of the RetryInfo delay the API attaches to
+    429 responses. Returns None when the error carries no suggestion."""
+    details = getattr(error, "details", None) or {}
+    try:
+        for detail in details.get("error", {}).get("details", []):
+            if detail.get("@type", "").endswith("RetryInfo"):
+                return float(detail["retryDelay"].rstrip("s"))
+    except (AttributeError, TypeError, ValueError):
+        pass
+    return None
+
+
+def _retry_backoff(
+    error: genai_errors.APIError, attempt: int, deadline: Optional[float]
+) -> float:
+    """Computes how long to wait before retry number `attempt` + 1.
+
+    Uses the server-suggested delay when present, otherwise exponential
+    backoff with full jitter so synchronized callers spread their retries
+    apart while the average wait stays low.
+
+    Raises:
+        error: Re-raised when waiting would cross the deadline.
+    """
+    delay = _suggested_retry_delay(error)
+    if delay is None:
+        delay = random.uniform(0, min(60, 2**attempt))
+    if deadline is not None and time.monotonic() + delay > deadline:
+        logger.error("Retry deadline would be exceeded; giving up.")
+        raise error
+    return delay
+
+
+class _TokenBucket:
+    """Token-bucket rate limiter refilled by wall-clock time.
+
+    Unlike a fixed inter-request floor, a bucket admits bursts up to `burst`
+    and only makes callers wait once the sustained rate exceeds
+    `rate_per_sec`, so throughput tracks the actual quota instead of being
+    artificially serialized.
+    """
+
+    def __init__(self, rate_per_sec: float, burst: float):
+        self.rate = rate_per_sec
+        self.capacity = burst
+        self.tokens = burst
+        self.last_refill = time.monotonic()
+        # Reservations come from many threads at once (the attempt race,
+        # the speculation thread); the refill/deduct sequence must be
+        # atomic or interleaved callers over-admit past the quota.
+        self._lock = Lock()
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """Deducts `amount` and returns how long the caller must wait.
+
+        The deduction happens immediately, so concurrent callers queue up
+        behind each other's reservations rather than all seeing a full
+        bucket.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.last_refill) * self.rate
+            )
+            self.last_refill = now
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class _JsonArrayStreamParser:
+    """
+    Incrementally extracts completed elements of a top-level JSON array field
+    from partially received JSON text.
+
+    Fed chunk by chunk, it returns the raw JSON text of each array element as
+    soon as its closing brace arrives, so callers can act on early elements
+    while the rest of the response is still being generated. The full raw
+    text is accumulated in `text` for a final whole-response parse.
+    """
+
+    def __init__(self, key: str):
+        self._key_marker = f'"{key}"'
+        self._found_array = False
+        self._finished = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._element_start: Optional[int] = None
+        self.text = ""
+
+    def feed(self, chunk: str) -> List[str]:
+        """Consumes a chunk of text and returns any newly completed elements."""
+        self.text += chunk
+        if self._finished:
+            return []
+
+        if not self._found_array:
+            marker_idx = self.text.find(self._key_marker)
+            if marker_idx == -1:
+                return []
+            bracket_idx = self.text.find("[", marker_idx + len(self._key_marker))
+            if bracket_idx == -1:
+                return []
+            self._found_array = True
+            self._pos = bracket_idx + 1
+
+        elements: List[str] = []
+        for i in range(self._pos, len(self.text)):
+            c = self.text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif c == "\\":
+                    self._escaped = True
+                elif c == '"':
+                    self._in_string = False
+                continue
+            if c == '"':
+                self._in_string = True
+            elif c == "{":
+                if self._depth == 0:
+                    self._element_start = i
+                self._depth += 1
+            elif c == "}":
+                self._depth -= 1
+                if self._depth == 0 and self._element_start is not None:
+                    elements.append(self.text[self._element_start : i + 1])
+                    self._element_start = None
+            elif c == "]" and self._depth == 0:
+                self._finished = True
+                self._pos = i + 1
+                return elements
+        self._pos = len(self.text)
+        return elements
+
+
 class LLMInterface:
     """Handles all communication with the Gemini API."""
 
-    def __init__(self, model: str = "gemini-2.5-pro"):
-        """Initializes the Gemini client and generative model."""
+    # Sustained prompt-token budget, sized to a ~250k tokens-per-minute
+    # quota. Estimated at ~4 characters per token when debiting.
+    TOKENS_PER_SEC = 4000.0
+
+    # Model tiers tried cheapest-first by `generate_with_cascade`.
+    CASCADE_MODELS = ["gemini-2.5-flash", "gemini-2.5-pro"]
+
+    # Provider-side lifetime of registered prompt prefixes, and how long
+    # before expiry a handle is proactively recreated.
+    PROMPT_CACHE_TTL_S = 600.0
+    PROMPT_CACHE_TTL_MARGIN_S = 30.0
+
+    def __init__(
+        self,
+        model: str = "gemini-2.5-pro",
+        response_cache: Optional[StructuralResponseCache] = None,
+        enable_cache: bool = True,
+        semantic_cache: Optional[SemanticCache] = None,
+        enable_semantic_cache: bool = False,
+        concurrency: int = 4,
+        rate_per_sec: float = 1.0,
+        burst: float = 5.0,
+    ):
+        """Initializes the Gemini client and generative model.
+
+        Args:
+            model: The Gemini model to use.
+            response_cache: Optional structural cache; when given, prompts
+                whose structural skeleton was already answered are served
+                from the cache without an API call.
+            enable_cache: Whether to consult the on-disk prompt cache, which
+                serves byte-identical repeated calls across runs from disk.
+            semantic_cache: Optional embedding-similarity cache serving
+                near-duplicate prompts (e.g. retry loops with a slightly
+                different error tail) from previous responses.
+            enable_semantic_cache: When no `semantic_cache` is given,
+                construct a default one backed by this interface's own
+                client, persisted alongside the prompt cache.
+            concurrency: Maximum number of in-flight async API calls, so a
+                large `asyncio.gather` fan-out stays within the per-key
+                concurrency the provider tolerates.
+            rate_per_sec: Sustained request rate admitted by the limiter.
+            burst: Number of requests that may be issued back-to-back
+                before the sustained rate applies.
+        """
         try:
             api_key = os.environ["GEMINI_API_KEY"]
             self.client = genai.Client(api_key=api_key)
@@ -25,73 +283,627 @@ class LLMInterface:
             raise
 
         self.model = model
-        self.last_request_time = 0  # Add timestamp for rate limiting
+        self.response_cache = response_cache
+        self.prompt_cache = PromptCache() if enable_cache else None
+        self.semantic_cache = semantic_cache
+        if self.semantic_cache is None and enable_semantic_cache:
+            self.semantic_cache = SemanticCache(
+                self.client, DEFAULT_CACHE_DIR / "semantic_cache.jsonl"
+            )
+        # Caps in-flight async calls; `asyncio.gather` fan-outs queue here
+        # instead of overwhelming the per-key limit with a request burst.
+        # Created lazily per running loop (see _get_semaphore): callers run
+        # each step in a fresh `asyncio.run` loop, and a semaphore awaited
+        # on one loop cannot be reused on another.
+        self._concurrency = concurrency
+        self._async_semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+        # Paired limiters for the provider's RPM and TPM quotas. Requests
+        # cost 1 from the first bucket; prompts debit their estimated token
+        # count from the second.
+        # Per-tier attempt/pass counts collected by `generate_with_cascade`,
+        # for judging whether the cheap tier is earning its place.
+        self.stats: Dict[str, Dict[str, int]] = {}
+        self._request_bucket = _TokenBucket(rate_per_sec, burst)
+        self._token_bucket = _TokenBucket(
+            self.TOKENS_PER_SEC, self.TOKENS_PER_SEC * 8
+        )
+        # Handles of static prompt prefixes registered with the provider's
+        # context cache, keyed by a caller-chosen name, with their creation
+        # time for TTL tracking. A None handle records that registration
+        # failed so we don't retry on every call.
+        self._prompt_caches: Dict[str, Tuple[Optional[str], float]] = {}
         logger.info("LLMInterface initialized successfully.")
 
-    def generate_json(self, prompt: str, response_model: Type[T]) -> T:
+    def ensure_prompt_cache(
+        self, key: str, text: str, model: Optional[str] = None
+    ) -> Optional[str]:
+        """
+        Registers a static prompt prefix with the provider's context cache.
+
+        The returned handle can be passed as `cached_content` to
+        `generate_json`/`agenerate_json` so the server-side KV cache for the
+        prefix is reused across calls instead of re-sending and re-prefilling
+        it every turn.
+
+        Args:
+            key: A stable name for the prefix (e.g. "code_agent.initial").
+            text: The static prefix text to cache.
+            model: Optional model the prefix is cached for; handles are
+                model-bound server-side, so overridden-model calls (e.g.
+                cascade tiers) need their own entry per model. Defaults to
+                the interface's model.
+
+        Entries are recreated shortly before the provider's TTL expires, so
+        long runs never send a handle the server has already dropped (which
+        would fail the call with a 404).
+
+        Returns:
+            The cached-content handle, or None if the provider rejected the
+            prefix (e.g. below the minimum cacheable token count). Callers
+            must inline the prefix into the prompt when None is returned.
+        """
+        model_name = model or self.model
+        if model is not None and model != self.model:
+            key = f"{key}@{model_name}"
+        entry = self._prompt_caches.get(key)
+        if entry is not None:
+            handle, created_at = entry
+            expired = (
+                handle is not None
+                and time.monotonic() - created_at
+                > self.PROMPT_CACHE_TTL_S - self.PROMPT_CACHE_TTL_MARGIN_S
+            )
+            if not expired:
+                return handle
+            logger.info(f"Prompt prefix cache '{key}' near expiry; recreating.")
+
+        try:
+            cache = self.client.caches.create(
+                model=model_name,
+                config={"contents": text, "ttl": f"{int(self.PROMPT_CACHE_TTL_S)}s"},
+            )
+            handle = cache.name
+            logger.info(f"Registered prompt prefix '{key}' as cached content.")
+        except Exception as e:
+            logger.warning(
+                f"Could not register prompt prefix '{key}' with the context "
+                f"cache ({e}). Falling back to inlining it."
+            )
+            handle = None
+
+        self._prompt_caches[key] = (handle, time.monotonic())
+        return handle
+
+    def _cache_key(
+        self,
+        prompt: str,
+        response_model: Type[T],
+        seed: Optional[int] = None,
+        model: Optional[str] = None,
+    ) -> Optional[str]:
+        """Computes the on-disk cache key for a call, or None when disabled.
+
+        The key covers model, prompt, response schema and the sampling seed,
+        so differently seeded candidates cache independently. Context-cache
+        handles are deliberately excluded: they are unique per session, and
+        the dynamic prompts sent under different prefixes differ anyway.
+        """
+        if self.prompt_cache is None:
+            return None
+        model_name = model or self.model
+        model_tag = model_name if seed is None else f"{model_name}#seed={seed}"
+        return PromptCache.make_key(
+            model_tag, prompt, _adapter(response_model).json_schema()
+        )
+
+    def _cache_lookup(self, key: Optional[str], response_model: Type[T]) -> Optional[T]:
+        """Returns the parsed cached response for `key`, or None on a miss."""
+        if key is None:
+            return None
+        raw = self.prompt_cache.get(key)
+        if raw is None:
+            return None
+        try:
+            parsed = _adapter(response_model).validate_json(raw)
+        except ValidationError as e:
+            logger.warning(f"Ignoring unparseable prompt cache entry {key}: {e}")
+            return None
+        logger.info("Prompt cache hit; skipping the API call.")
+        return parsed
+
+    def _semantic_lookup(
+        self, prompt: str, response_model: Type[T]
+    ) -> Tuple[Optional[List[float]], Optional[T]]:
+        """Looks up a near-duplicate prompt in the semantic cache.
+
+        Returns the query embedding (for storing the eventual response) and
+        the parsed cached response, either of which may be None.
+        """
+        if self.semantic_cache is None:
+            return None, None
+        embedding, raw = self.semantic_cache.lookup(prompt)
+        if raw is None:
+            return embedding, None
+        try:
+            return embedding, _adapter(response_model).validate_json(raw)
+        except ValidationError as e:
+            logger.warning(f"Ignoring unparseable semantic cache hit: {e}")
+            return embedding, None
+
+    def generate_json(
+        self,
+        prompt: str,
+        response_model: Type[T],
+        cached_content: Optional[str] = None,
+        retry_deadline: Optional[float] = None,
+        seed: Optional[int] = None,
+        model: Optional[str] = None,
+    ) -> T:
         """
         Generates a JSON object from a prompt, with rate limiting and retry logic.
 
         Args:
             prompt: The user's prompt describing the desired functionality.
             response_model: The Pydantic model for the expected JSON response.
+            cached_content: Optional handle from `ensure_prompt_cache`; when
+                given, the provider prepends the cached prefix server-side.
+            retry_deadline: Optional total retry budget in seconds; backoff
+                waits that would cross it re-raise the last error instead.
+            seed: Optional sampling seed. Concurrent candidates pass
+                distinct seeds so identically prompted calls produce
+                independent samples; the fuzzy caches (structural,
+                semantic) are bypassed for seeded calls, since serving one
+                stored answer to every candidate would defeat the point.
+            model: Optional model name overriding the interface default for
+                this call only. Passed explicitly (rather than mutated on
+                the shared interface) so concurrent callers never observe
+                each other's model choice.
 
         Returns:
             A Pydantic model instance of the response.
         """
-        # Simple rate limiting: ensure at least 10 seconds between requests
-        current_time = time.time()
-        if self.last_request_time > 0:
-            time_since_last_request = current_time - self.last_request_time
-            if time_since_last_request < 10:
-                sleep_duration = 10 - time_since_last_request
-                logger.info(f"Rate limiting. Waiting for {sleep_duration:.2f} seconds.")
-                time.sleep(sleep_duration)
+        # The fuzzy caches (structural, semantic) are keyed on the prompt
+        # alone, so they are also skipped for model-overridden calls: a
+        # cheaper tier's answer must not be served to an escalated one.
+        if self.response_cache is not None and seed is None and model is None:
+            cached_response = self.response_cache.get(prompt, response_model)
+            if cached_response is not None:
+                return cached_response
 
-        # Update the last request time before making the new request
-        self.last_request_time = time.time()
+        cache_key = self._cache_key(prompt, response_model, seed, model)
+        cached = self._cache_lookup(cache_key, response_model)
+        if cached is not None:
+            return cached
 
+        if seed is None and model is None:
+            semantic_embedding, semantic_hit = self._semantic_lookup(
+                prompt, response_model
+            )
+            if semantic_hit is not None:
+                return semantic_hit
+        else:
+            semantic_embedding = None
+
+        self._throttle(prompt)
+
+        config = dict(_response_config(response_model))
+        if cached_content:
+            config["cached_content"] = cached_content
+        if seed is not None:
+            config["seed"] = seed
+
+        deadline = (
+            None if retry_deadline is None else time.monotonic() + retry_deadline
+        )
         max_retries = 3
         for attempt in range(max_retries):
             try:
                 logger.info(f"Sending prompt (attempt {attempt + 1}/{max_retries}).")
-                logger.debug(f"Prompt: '{prompt}'")
+                logger.debug("Prompt: '%s'", prompt)
 
                 response = self.client.models.generate_content(
-                    model=self.model,
+                    model=model or self.model,
                     contents=prompt,
-                    config={
-                        "response_mime_type": "application/json",
-                        "response_schema": response_model,
-                    },
+                    config=config,
                 )
 
-                logger.debug(f"Received raw response: {response.text}")
+                logger.debug("Received raw response: %s", response.text)
                 logger.info("Received response from LLM.")
 
                 try:
-                    output_dict = json.loads(response.text)
+                    parsed = _adapter(response_model).validate_json(response.text)
                     logger.info("Successfully parsed LLM response.")
-                    return response_model(**output_dict)
-                except (json.JSONDecodeError, TypeError) as e:
+                    if (
+                        self.response_cache is not None
+                        and seed is None
+                        and model is None
+                    ):
+                        self.response_cache.put(prompt, parsed)
+                    if cache_key is not None:
+                        self.prompt_cache.set(cache_key, response.text)
+                    if semantic_embedding is not None:
+                        self.semantic_cache.put(semantic_embedding, response.text)
+                    return parsed
+                except ValidationError as e:
                     logger.error(f"Failed to parse LLM response as JSON: {e}")
                     logger.error(f"Raw LLM response: {response.text}")
                     # This is not a server error, so we don't retry.
                     raise ValueError("LLM did not return a valid JSON object.") from e
 
-            except genai_errors.ServerError as e:
+            except genai_errors.APIError as e:
+                if not _is_retryable(e):
+                    raise
                 logger.warning(
-                    f"Server error on attempt {attempt + 1}/{max_retries}: {e}"
+                    f"Retryable API error on attempt {attempt + 1}/{max_retries}: {e}"
                 )
-                if attempt < max_retries - 1:
-                    logger.info("Waiting 2 minutes before retrying...")
-                    time.sleep(300)
-                else:
+                if attempt >= max_retries - 1:
                     logger.error(
                         "Max retries reached. Could not get a response from the server."
                     )
                     raise  # Re-raise the last exception
+                delay = _retry_backoff(e, attempt, deadline)
+                logger.info(f"Retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
 
         # This line should not be reachable if the loop is correct.
         # It's a fallback in case the loop finishes without returning or raising.
         raise RuntimeError("Failed to get a response from the LLM after all retries.")
+
+    def generate_json_batch(
+        self,
+        prompts: List[str],
+        response_model: Type[T],
+    ) -> List[T]:
+        """Answers several independent prompts with one provider request.
+
+        The prompts are concatenated as delimited tasks under a shared
+        header and the response schema is a list of `response_model`, so
+        the request overhead and any common preamble are paid once instead
+        of per prompt. A batch of one degenerates to a plain
+        `generate_json` call. Intended for callers that already hold N
+        prompts; nothing in the shipped pipeline batches implicitly.
+
+        Args:
+            prompts: The independent task prompts, answered in order.
+            response_model: The Pydantic model for one task's response.
+
+        Returns:
+            One parsed result per prompt, in prompt order.
+
+        Raises:
+            ValueError: If the model returns a result count that does not
+                match the number of prompts.
+        """
+        if not prompts:
+            return []
+        if len(prompts) == 1:
+            return [
+                self.generate_json(prompt=prompts[0], response_model=response_model)
+            ]
+
+        parts = [_BATCH_PROMPT_HEADER.format(n=len(prompts))]
+        for i, prompt in enumerate(prompts, start=1):
+            parts.append(f"--- TASK {i} ---\n{prompt}\n--- END TASK {i} ---")
+
+        batched = self.generate_json(
+            prompt="\n\n".join(parts), response_model=_batch_model(response_model)
+        )
+        if len(batched.results) != len(prompts):
+            raise ValueError(
+                f"Batched call returned {len(batched.results)} results "
+                f"for {len(prompts)} tasks."
+            )
+        return batched.results
+
+    def generate_with_cascade(
+        self,
+        prompt: str,
+        response_model: Type[T],
+        tester: Callable[[T], bool],
+        prefix_key: Optional[str] = None,
+        prefix: Optional[str] = None,
+        seed: Optional[int] = None,
+    ) -> T:
+        """Tries model tiers cheapest-first, escalating while `tester` fails.
+
+        Most requests are satisfied by the cheaper, faster tier; the
+        expensive model is reserved for the cases the tester (typically
+        "does the generated code pass its run?") rejects. Each tier is
+        requested with an explicit per-call `model` override, so concurrent
+        callers of the shared interface never see a mutated default model.
+
+        Args:
+            prompt: The prompt WITHOUT its static preamble when `prefix` is
+                given; the preamble is attached per tier, since context-cache
+                handles are model-bound and cannot be shared across tiers.
+            response_model: The Pydantic model for the expected JSON response.
+            tester: Judges a parsed response; True stops the cascade.
+            prefix_key: Stable name for the static preamble, passed to
+                `ensure_prompt_cache` per tier.
+            prefix: The static preamble text. Inlined into the prompt for
+                tiers where no context-cache handle could be obtained.
+            seed: Optional sampling seed, forwarded to each tier's call.
+
+        Returns:
+            The first response that passes `tester`, or the final tier's
+            response when none does. Per-tier attempt/pass counts are
+            accumulated in `self.stats`.
+
+        Raises:
+            Whatever the final tier's call raises; lower tiers' failures
+            (malformed JSON, exhausted retries, non-retryable API errors)
+            escalate instead of propagating, since producing an unusable
+            response is exactly what escalation is for.
+        """
+        result: Optional[T] = None
+        final_tier = self.CASCADE_MODELS[-1]
+        for tier in self.CASCADE_MODELS:
+            cached_content = None
+            tier_prompt = prompt
+            if prefix is not None:
+                if prefix_key is not None:
+                    cached_content = self.ensure_prompt_cache(
+                        prefix_key, prefix, model=tier
+                    )
+                if cached_content is None:
+                    tier_prompt = prefix + prompt
+            tier_stats = self.stats.setdefault(tier, {"attempts": 0, "passes": 0})
+            try:
+                result = self.generate_json(
+                    tier_prompt,
+                    response_model,
+                    cached_content=cached_content,
+                    seed=seed,
+                    model=tier,
+                )
+            except (ValueError, genai_errors.APIError) as e:
+                # The cheap tier's dominant failure mode is malformed
+                # structured output (ValueError from the JSON parse); an
+                # APIError here already survived generate_json's retries.
+                if tier == final_tier:
+                    raise
+                tier_stats["attempts"] += 1
+                logger.warning(f"Cascade: '{tier}' failed ({e}); escalating.")
+                continue
+            tier_stats["attempts"] += 1
+            if tester(result):
+                tier_stats["passes"] += 1
+                logger.info(f"Cascade: '{tier}' passed ({tier_stats}).")
+                return result
+            logger.info(f"Cascade: '{tier}' response rejected; escalating.")
+        return result
+
+    def _reserve(self, prompt: str) -> float:
+        """Debits the rate buckets for one call and returns the wait time."""
+        wait = self._request_bucket.reserve(1.0)
+        return max(wait, self._token_bucket.reserve(len(prompt) / 4))
+
+    def _throttle(self, prompt: str = "") -> None:
+        """Blocks until the rate budget admits one request (blocking)."""
+        wait = self._reserve(prompt)
+        if wait > 0:
+            logger.info(f"Rate limiting. Waiting for {wait:.2f} seconds.")
+            time.sleep(wait)
+
+    async def _athrottle(self, prompt: str = "") -> None:
+        """Blocks until the rate budget admits one request (non-blocking)."""
+        wait = self._reserve(prompt)
+        if wait > 0:
+            logger.info(f"Rate limiting. Waiting for {wait:.2f} seconds.")
+            await asyncio.sleep(wait)
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """Returns the concurrency semaphore for the current event loop.
+
+        A semaphore binds to the loop it first waits on, and each
+        orchestrator step runs in its own short-lived `asyncio.run` loop;
+        reusing one constructed at init time raises "bound to a different
+        event loop" on the second step. Loops here never run concurrently,
+        so swapping in a fresh semaphore per loop preserves the cap.
+        """
+        loop = asyncio.get_running_loop()
+        if self._async_semaphore is None or self._semaphore_loop is not loop:
+            self._async_semaphore = asyncio.Semaphore(self._concurrency)
+            self._semaphore_loop = loop
+        return self._async_semaphore
+
+    def generate_json_stream(
+        self,
+        prompt: str,
+        response_model: Type[T],
+        item_model: Type[BaseModel],
+        key: str = "files",
+        cached_content: Optional[str] = None,
+    ) -> Iterator[BaseModel]:
+        """
+        Streams a structured response, yielding each completed element of the
+        top-level `key` array as soon as it closes in the stream.
+
+        This lets callers overlap downstream work (e.g. writing generated
+        files into the sandbox workspace) with the remainder of the
+        generation instead of waiting for the full response. The generator's
+        return value is the fully parsed `response_model` instance, reachable
+        via `yield from` delegation.
+
+        This path is deliberately not wired into the shipped pipeline: the
+        attempt racer needs whole buffered responses for its caching, retry,
+        seeding and cascade machinery (all keyed on complete responses), and
+        the streaming call bypasses every one of those. It stays as opt-in
+        surface for single-candidate integrations that want to overlap file
+        writes (e.g. feeding items into `DockerSandbox.sync_files`) with the
+        tail of the generation.
+
+        Args:
+            prompt: The user's prompt.
+            response_model: The Pydantic model for the full JSON response.
+            item_model: The Pydantic model for one element of the array.
+            key: The name of the top-level array field to stream.
+            cached_content: Optional handle from `ensure_prompt_cache`.
+
+        Yields:
+            `item_model` instances, in generation order.
+
+        Returns:
+            The fully parsed `response_model` instance.
+        """
+        self._throttle(prompt)
+
+        config = dict(_response_config(response_model))
+        if cached_content:
+            config["cached_content"] = cached_content
+
+        logger.info("Sending streaming prompt.")
+        parser = _JsonArrayStreamParser(key)
+        for chunk in self.client.models.generate_content_stream(
+            model=self.model, contents=prompt, config=config
+        ):
+            for raw_element in parser.feed(chunk.text or ""):
+                yield _adapter(item_model).validate_json(raw_element)
+
+        try:
+            parsed = _adapter(response_model).validate_json(parser.text)
+        except ValidationError as e:
+            logger.error(f"Failed to parse streamed LLM response as JSON: {e}")
+            raise ValueError("LLM did not return a valid JSON object.") from e
+        logger.info("Successfully parsed streamed LLM response.")
+        return parsed
+
+    async def agenerate_json_stream(
+        self,
+        prompt: str,
+        response_model: Type[T],
+        item_model: Type[BaseModel],
+        key: str = "files",
+        cached_content: Optional[str] = None,
+    ) -> AsyncIterator[BaseModel]:
+        """
+        Async variant of `generate_json_stream`.
+
+        Yields `item_model` instances as array elements complete. Async
+        generators cannot carry a return value, so callers that also need the
+        fully parsed response should use the sync variant via `yield from`.
+        """
+        await self._athrottle(prompt)
+
+        config = dict(_response_config(response_model))
+        if cached_content:
+            config["cached_content"] = cached_content
+
+        logger.info("Sending streaming prompt.")
+        parser = _JsonArrayStreamParser(key)
+        async for chunk in await self.client.aio.models.generate_content_stream(
+            model=self.model, contents=prompt, config=config
+        ):
+            for raw_element in parser.feed(chunk.text or ""):
+                yield _adapter(item_model).validate_json(raw_element)
+
+    async def agenerate_json(
+        self,
+        prompt: str,
+        response_model: Type[T],
+        cached_content: Optional[str] = None,
+        retry_deadline: Optional[float] = None,
+        seed: Optional[int] = None,
+    ) -> T:
+        """
+        Async variant of `generate_json` built on the client's async API.
+
+        Awaiting this coroutine never blocks the event loop: rate-limit and
+        retry waits use `asyncio.sleep`, so multiple agents can interleave
+        their I/O-bound LLM calls (e.g. via `asyncio.gather`). Note that a
+        single `LLMInterface` (and the agents built on it) is not
+        coroutine-safe; instantiate one per concurrent task.
+
+        Args:
+            prompt: The user's prompt describing the desired functionality.
+            response_model: The Pydantic model for the expected JSON response.
+            cached_content: Optional handle from `ensure_prompt_cache`; when
+                given, the provider prepends the cached prefix server-side.
+            retry_deadline: Optional total retry budget in seconds; backoff
+                waits that would cross it re-raise the last error instead.
+            seed: Optional sampling seed; see `generate_json`.
+
+        Returns:
+            A Pydantic model instance of the response.
+        """
+        if self.response_cache is not None and seed is None:
+            cached_response = self.response_cache.get(prompt, response_model)
+            if cached_response is not None:
+                return cached_response
+
+        cache_key = self._cache_key(prompt, response_model, seed)
+        cached = self._cache_lookup(cache_key, response_model)
+        if cached is not None:
+            return cached
+
+        if seed is None:
+            # The lookup embeds the prompt via a blocking API call, so run
+            # it on a worker thread to keep the event loop free.
+            semantic_embedding, semantic_hit = await asyncio.to_thread(
+                self._semantic_lookup, prompt, response_model
+            )
+            if semantic_hit is not None:
+                return semantic_hit
+        else:
+            semantic_embedding = None
+
+        await self._athrottle(prompt)
+
+        config = dict(_response_config(response_model))
+        if cached_content:
+            config["cached_content"] = cached_content
+        if seed is not None:
+            config["seed"] = seed
+
+        deadline = (
+            None if retry_deadline is None else time.monotonic() + retry_deadline
+        )
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                logger.info(f"Sending prompt (attempt {attempt + 1}/{max_retries}).")
+                logger.debug("Prompt: '%s'", prompt)
+
+                async with self._get_semaphore():
+                    response = await self.client.aio.models.generate_content(
+                        model=self.model,
+                        contents=prompt,
+                        config=config,
+                    )
+
+                logger.debug("Received raw response: %s", response.text)
+                logger.info("Received response from LLM.")
+
+                try:
+                    parsed = _adapter(response_model).validate_json(response.text)
+                    logger.info("Successfully parsed LLM response.")
+                    if self.response_cache is not None:
+                        self.response_cache.put(prompt, parsed)
+                    if cache_key is not None:
+                        self.prompt_cache.set(cache_key, response.text)
+                    if semantic_embedding is not None:
+                        self.semantic_cache.put(semantic_embedding, response.text)
+                    return parsed
+                except ValidationError as e:
+                    logger.error(f"Failed to parse LLM response as JSON: {e}")
+                    logger.error(f"Raw LLM response: {response.text}")
+                    # This is not a server error, so we don't retry.
+                    raise ValueError("LLM did not return a valid JSON object.") from e
+
+            except genai_errors.APIError as e:
+                if not _is_retryable(e):
+                    raise
+                logger.warning(
+                    f"Retryable API error on attempt {attempt + 1}/{max_retries}: {e}"
+                )
+                if attempt >= max_retries - 1:
+                    logger.error(
+                        "Max retries reached. Could not get a response from the server."
+                    )
+                    raise  # Re-raise the last exception
+                delay = _retry_backoff(e, attempt, deadline)
+                logger.info(f"Retrying in {delay:.1f} seconds...")
+                await asyncio.sleep(delay)
+
+        raise RuntimeError("Failed to get a response from the LLM after all retries.")
@@ -0,0 +1,67 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "codingagent"
+
+
+class PromptCache:
+    """
+    Content-addressed on-disk cache of raw LLM responses.
+
+    Entries are keyed by a SHA-256 over (model, prompt, response schema), so
+    an identical structured call issued again — typically across repeated dev
+    runs of the same objective — is served from disk in microseconds instead
+    of paying the network round-trip and token cost again.
+
+    The interface is a narrow get/set over opaque keys so a different backend
+    (e.g. a shared networked store) can be swapped in without touching
+    callers. Writes are atomic (`os.replace`), so concurrent processes never
+    observe a partially written entry.
+    """
+
+    def __init__(self, cache_dir: Union[Path, str] = DEFAULT_CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(model: str, prompt: str, schema: Dict) -> str:
+        """Computes the content hash identifying one structured call."""
+        payload = json.dumps(
+            {"m": model, "p": prompt, "s": schema}, sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached raw response text, or None on a miss."""
+        try:
+            return self._path(key).read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Could not read prompt cache entry {key}: {e}")
+            return None
+
+    def set(self, key: str, text: str) -> None:
+        """Stores raw response text under `key`, atomically.
+
+        Cache writes are best-effort: a full disk or permission problem is
+        logged and ignored rather than failing the LLM call that produced
+        the response.
+        """
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Could not write prompt cache entry {key}: {e}")
@@ -0,0 +1,88 @@
+import string
+from typing import Callable, List, Mapping, Optional, Sequence, Tuple
+
+# Compiled form of a template: interleaved (literal, slot_index) segments
+# plus the ordered slot names the indices refer to.
+CompiledTemplate = Tuple[Tuple[Tuple[str, Optional[int]], ...], Tuple[str, ...]]
+
+_FORMATTER = string.Formatter()
+
+
+def compile_template(template: str) -> CompiledTemplate:
+    """Precompiles a `str.format`-style template for repeated rendering.
+
+    `str.format` re-scans the whole template for replacement fields on every
+    call, which is wasteful for multi-KB prompt templates rendered in the hot
+    orchestration loop. Parsing once (at import time) turns each render into
+    a linear join of cached literals and substituted values.
+
+    Args:
+        template: A template using plain `{name}` replacement fields.
+
+    Returns:
+        A (segments, slot_names) pair for use with `render_template`.
+
+    Raises:
+        ValueError: If the template uses conversions or format specs, which
+            the fast renderer deliberately does not support.
+    """
+    segments: List[Tuple[str, Optional[int]]] = []
+    slot_names: List[str] = []
+    for literal, field, spec, conversion in _FORMATTER.parse(template):
+        if field is None:
+            segments.append((literal, None))
+            continue
+        if spec or conversion:
+            raise ValueError(
+                f"Template field '{field}' uses a format spec or conversion; "
+                "only plain '{name}' slots are supported."
+            )
+        if field not in slot_names:
+            slot_names.append(field)
+        segments.append((literal, slot_names.index(field)))
+    return tuple(segments), tuple(slot_names)
+
+
+def render_template(compiled: CompiledTemplate, values: Mapping[str, object]) -> str:
+    """Renders a compiled template by joining literals and slot values."""
+    segments, slot_names = compiled
+    return "".join(
+        literal if index is None else f"{literal}{values[slot_names[index]]}"
+        for literal, index in segments
+    )
+
+
+def make_renderer(template: str, arg_names: Sequence[str]) -> Callable[..., str]:
+    """Specializes a template into a positional-argument renderer.
+
+    The returned closure takes the slot values positionally in `arg_names`
+    order, so hot callers skip both the per-call kwargs dict construction and
+    the slot-name lookups of the mapping-based `render_template` path.
+
+    Args:
+        template: A template using plain `{name}` replacement fields.
+        arg_names: The positional order of the template's slot names.
+
+    Returns:
+        A callable rendering the template from positional slot values.
+
+    Raises:
+        ValueError: If the template references a slot not in `arg_names`.
+    """
+    segments, slot_names = compile_template(template)
+    index_of = {name: i for i, name in enumerate(arg_names)}
+    missing = set(slot_names) - index_of.keys()
+    if missing:
+        raise ValueError(f"Template slots missing from arg_names: {sorted(missing)}")
+    plan = tuple(
+        (literal, None if index is None else index_of[slot_names[index]])
+        for literal, index in segments
+    )
+
+    def render(*args: object) -> str:
+        return "".join(
+            literal if index is None else f"{literal}{args[index]}"
+            for literal, index in plan
+        )
+
+    return render
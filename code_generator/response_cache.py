@@ -0,0 +1,67 @@
+import hashlib
+import logging
+import re
+from typing import Dict, Optional, Tuple, Type, TypeVar
+
+from pydantic import BaseModel
+
+T = TypeVar("T", bound=BaseModel)
+
+logger = logging.getLogger(__name__)
+
+# Variable content the agents interpolate into their templates: delimited
+# blocks (e.g. --- HISTORY --- ... --- END HISTORY ---), quoted values and
+# numbers. Masking them leaves only the structural skeleton of the prompt.
+_BLOCK_RE = re.compile(r"--- (?P<name>[A-Z ]+) ---.*?--- END (?P=name) ---", re.DOTALL)
+_QUOTED_RE = re.compile(r'"[^"\n]*"')
+_NUMBER_RE = re.compile(r"\d+")
+
+
+class StructuralResponseCache:
+    """
+    Caches parsed LLM responses keyed by the structural skeleton of a prompt.
+
+    Orchestration loops re-issue prompts that share the same template and
+    differ only in their variable slots (objective, history, feedback). An
+    exact-text cache never hits on those, so this cache masks the slot
+    content before hashing and returns the stored response when the same
+    skeleton comes around again, skipping the network round-trip entirely.
+
+    Reusing a response across prompts whose masked slots differ is an
+    aggressive trade-off: it is only sound for workloads where the slots do
+    not change the desired answer. The cache is therefore opt-in — pass an
+    instance to `LLMInterface(response_cache=...)` to enable it.
+    """
+
+    def __init__(self) -> None:
+        self._store: Dict[Tuple[str, str], str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def skeleton_hash(prompt: str) -> str:
+        """Masks the variable slots of a prompt and hashes what remains."""
+        skeleton = _BLOCK_RE.sub(lambda m: f"--- {m.group('name')} ---", prompt)
+        skeleton = _QUOTED_RE.sub('""', skeleton)
+        skeleton = _NUMBER_RE.sub("0", skeleton)
+        return hashlib.sha256(skeleton.encode("utf-8")).hexdigest()
+
+    def get(self, prompt: str, response_model: Type[T]) -> Optional[T]:
+        """Returns a fresh copy of the cached response for this prompt's
+        skeleton, or None on a miss."""
+        key = (response_model.__name__, self.skeleton_hash(prompt))
+        raw = self._store.get(key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        logger.info(
+            f"Structural cache hit for {response_model.__name__} "
+            f"({self.hits} hits / {self.misses} misses)."
+        )
+        return response_model.model_validate_json(raw)
+
+    def put(self, prompt: str, response: BaseModel) -> None:
+        """Stores a parsed response under this prompt's skeleton."""
+        key = (type(response).__name__, self.skeleton_hash(prompt))
+        self._store[key] = response.model_dump_json()
@@ -1,24 +1,38 @@
+import atexit
+import hashlib
 import os
+import shlex
 import subprocess
 import tempfile
 import shutil
 import textwrap
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Optional, List
+from threading import Thread
+from typing import Iterable, Optional, List
 from pathlib import Path
 
-from pydantic import BaseModel, Field
+# The canonical CodeFile lives in llm_interface; re-declaring it here would
+# make pydantic build a second identical validator and turn cross-module
+# passing into a type mismatch.
+from code_generator.llm_interface import CodeFile
+from code_generator.prompt_cache import DEFAULT_CACHE_DIR
 
 
-# Import the CodeFile class from the llm_interface module
-class CodeFile(BaseModel):
-    relative_path: str = Field(
-        ..., description="The path of the file relative to the workspace root."
-    )
-    content: str = Field(
-        ..., description="The full source code or text content of the file."
-    )
+def _fast_tmpdir() -> Optional[str]:
+    """Returns a tmpfs-backed parent directory for workspaces, if available.
+
+    On tmpfs both the file writes and the recursive cleanup in `__exit__`
+    are memory operations, so teardown of a large generated project stops
+    paying one disk syscall per file. Falls back to the default temp
+    location (None) elsewhere.
+    """
+    shm = Path("/dev/shm")
+    if os.name == "posix" and shm.is_dir() and os.access(shm, os.W_OK):
+        return str(shm)
+    return None
 
 
 # --- Data Structures ---
@@ -42,108 +56,494 @@ class DockerSandbox:
     """Manages the lifecycle of a sandboxed Docker execution environment."""
 
     DOCKER_IMAGE_NAME: str = "python-uv-image"
+    # Resolved image tag (name:dockerfile-hash), computed once per process
+    # by `image_name`. Tagging by content hash means a Dockerfile edit
+    # yields a new tag that doesn't exist yet and so triggers a rebuild,
+    # while unchanged Dockerfiles keep skipping the multi-second build.
+    _image_tag: Optional[str] = None
     WORKSPACE_HOST_PREFIX: str = "gemini_workspace_"
+    WRITE_WORKERS: int = 8
+    # Lines of stdout/stderr retained per stream; older output is dropped
+    # so runaway test logs cannot grow memory without bound.
+    OUTPUT_TAIL_LINES: int = 1000
+    # Grace period granted by the in-container `timeout` between TERM at
+    # the deadline and the follow-up KILL for commands that ignore TERM.
+    TIMEOUT_KILL_GRACE_S: int = 10
+
+    # Long-lived worker container reused across executions. Starting a fresh
+    # container per run() costs several hundred milliseconds; a warm worker
+    # turns each execution into a cheap `docker exec`. The worker mounts a
+    # single host base directory at /workspaces and every sandbox places its
+    # workspace in a subdirectory of it. The name is suffixed per process
+    # (see worker_container_name) so concurrent runs on one host never
+    # remove or exec into each other's worker.
+    WORKER_CONTAINER_PREFIX: str = "codingagent_worker"
+    WORKER_MOUNT_POINT: str = "/workspaces"
+    _worker_base: Optional[Path] = None
+
+    # Host directory mounted into every container as uv's cache, so the
+    # wheels and resolution metadata downloaded by one dependency install
+    # are reused by all later installs across containers and processes.
+    # The requirements set is generated per run, so the cache cannot be
+    # baked into an image layer; a shared mount is the next best thing.
+    UV_CACHE_MOUNT_POINT: str = "/uv-cache"
 
-    def __init__(self, files: List[CodeFile], command: str):
+    # Content-addressed store shared by all sandboxes in this process.
+    # Refinement attempts rewrite mostly-unchanged files; hardlinking
+    # already-seen content into the new workspace makes materialization
+    # O(changed files) instead of O(all files).
+    _objects_dir: Optional[Path] = None
+
+    def __init__(
+        self,
+        files: Iterable[CodeFile],
+        command: str,
+        stdout_path: Optional[Path] = None,
+        stderr_path: Optional[Path] = None,
+    ):
         """Initializes the sandbox with its state.
 
         Args:
-            files: A list of CodeFile objects to create in the workspace.
+            files: The CodeFile objects to create in the workspace. May be a
+                lazy iterator (e.g. a streaming LLM response via
+                `LLMInterface.generate_json_stream`); files are then written
+                to disk as they complete, overlapping with generation.
             command: The command to execute within the sandbox.
+            stdout_path: When set, executed commands stream their full
+                stdout to this file (appending) as it is produced, beyond
+                the bounded tail kept in memory. May be reassigned between
+                executions of a persistent sandbox.
+            stderr_path: Like `stdout_path`, for stderr.
         """
         self.files = files
         self.command = command
+        self.stdout_path = stdout_path
+        self.stderr_path = stderr_path
         self.workspace_path: Optional[Path] = None
+        self._use_worker = False
+        # Relative paths written by the last sync, so a re-sync into a
+        # persistent workspace can remove files the agent dropped without
+        # touching setup state such as a .venv.
+        self._synced_paths: set = set()
+        self._setup_key: Optional[tuple] = None
 
     def __enter__(self) -> "DockerSandbox":
-        """Sets up the workspace when entering the 'with' context."""
-        self.workspace_path = Path(tempfile.mkdtemp(prefix=self.WORKSPACE_HOST_PREFIX))
-        logging.info(f"Created temporary workspace: {self.workspace_path}")
+        """Sets up the workspace when entering the 'with' context.
 
-        for code_file in self.files:
-            full_path = self.workspace_path / code_file.relative_path
-            full_path.parent.mkdir(parents=True, exist_ok=True)
-            full_path.write_text(code_file.content)
+        Consumes `files` incrementally, so when it is a generator each file
+        is dispatched for writing as soon as it is yielded. After entry
+        `self.files` is the materialized list.
+        """
+        worker_base = self._ensure_worker()
+        if worker_base is not None:
+            self.workspace_path = Path(
+                tempfile.mkdtemp(prefix=self.WORKSPACE_HOST_PREFIX, dir=worker_base)
+            )
+            self._use_worker = True
+        else:
+            self.workspace_path = Path(
+                tempfile.mkdtemp(
+                    prefix=self.WORKSPACE_HOST_PREFIX, dir=_fast_tmpdir()
+                )
+            )
+        logging.info(f"Created temporary workspace: {self.workspace_path}")
+        self.files = self.sync_files(self.files)
         return self
 
+    @classmethod
+    def open_persistent(cls) -> "DockerSandbox":
+        """Opens a sandbox whose workspace outlives individual executions.
+
+        Callers sync files and exec commands attempt by attempt — setup
+        state such as a venv survives between executions — and must call
+        `close()` when done. The per-execution `with` form stays the right
+        choice for one-shot runs.
+        """
+        return cls(files=(), command="").__enter__()
+
+    def close(self) -> None:
+        """Tears down a sandbox opened with `open_persistent`."""
+        self.__exit__(None, None, None)
+
+    def sync_files(self, files: Iterable[CodeFile]) -> List[CodeFile]:
+        """Makes the workspace's code files match `files`.
+
+        Each unique parent directory is created once instead of re-stating
+        it per file, and the writes themselves run on a small thread pool —
+        they are I/O bound and release the GIL, so a many-file workspace
+        materializes concurrently instead of paying one serial syscall
+        round-trip per file. Files written by a previous sync and absent
+        from `files` are removed; anything else the workspace accumulated
+        (e.g. a .venv from `ensure_setup`) is left in place.
+
+        Returns:
+            The materialized files as a list.
+        """
+        if not self.workspace_path:
+            raise TypeError("sync_files() requires an open workspace.")
+
+        written: List[CodeFile] = []
+        synced: set = set()
+        known_dirs = {self.workspace_path}
+        objects_dir = self._ensure_object_store()
+        with ThreadPoolExecutor(max_workers=self.WRITE_WORKERS) as pool:
+            futures = []
+            for code_file in files:
+                full_path = self.workspace_path / code_file.relative_path
+                parent = full_path.parent
+                if parent not in known_dirs:
+                    parent.mkdir(parents=True, exist_ok=True)
+                    known_dirs.add(parent)
+                futures.append(
+                    pool.submit(
+                        self._materialize,
+                        objects_dir,
+                        full_path,
+                        code_file.content_bytes,
+                    )
+                )
+                synced.add(code_file.relative_path)
+                written.append(code_file)
+            for future in futures:
+                future.result()
+        for stale in self._synced_paths - synced:
+            (self.workspace_path / stale).unlink(missing_ok=True)
+        self._synced_paths = synced
+        return written
+
+    @classmethod
+    def _ensure_object_store(cls) -> Path:
+        """Creates (once) the per-process content-addressed object dir."""
+        if cls._objects_dir is None:
+            cls._objects_dir = Path(
+                tempfile.mkdtemp(prefix="codingagent_objects_", dir=_fast_tmpdir())
+            )
+            atexit.register(shutil.rmtree, cls._objects_dir, ignore_errors=True)
+        return cls._objects_dir
+
+    @staticmethod
+    def _materialize(objects_dir: Path, full_path: Path, data: bytes) -> None:
+        """Places `data` at `full_path` via the content-addressed store.
+
+        Content already seen by a previous attempt is hardlinked instead of
+        rewritten. A cross-filesystem link failure falls back to a plain
+        write. Workspace files are never mutated in place by the executed
+        commands, so sharing inodes between attempts is safe.
+        """
+        obj_path = objects_dir / hashlib.sha256(data).hexdigest()
+        if not obj_path.exists():
+            obj_path.write_bytes(data)
+        # A re-sync into a persistent workspace may be replacing an earlier
+        # version of the file; the link target must not exist.
+        full_path.unlink(missing_ok=True)
+        try:
+            os.link(obj_path, full_path)
+        except OSError:
+            full_path.write_bytes(data)
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         """Cleans up the workspace when exiting the 'with' context."""
         if self.workspace_path and self.workspace_path.exists():
             shutil.rmtree(self.workspace_path)
             logging.info(f"Cleaned up temporary workspace: {self.workspace_path}")
 
+    @classmethod
+    def _cache_mount_args(cls) -> List[str]:
+        """Docker arguments mounting the shared uv cache into a container."""
+        cache_dir = DEFAULT_CACHE_DIR / "uv"
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        return [
+            f"--volume={cache_dir}:{cls.UV_CACHE_MOUNT_POINT}",
+            "-e",
+            f"UV_CACHE_DIR={cls.UV_CACHE_MOUNT_POINT}",
+        ]
+
+    @classmethod
+    def worker_container_name(cls) -> str:
+        """This process's worker container name.
+
+        Suffixed with the PID: the name must be stable within a process
+        (execs address the worker by name) but unique across processes, or
+        a second concurrent run would remove and exec into the first run's
+        live worker.
+        """
+        return f"{cls.WORKER_CONTAINER_PREFIX}_{os.getpid()}"
+
+    @classmethod
+    def _ensure_worker(cls) -> Optional[Path]:
+        """Starts (once) the long-lived worker container.
+
+        Returns:
+            The host base directory mounted into the worker, or None when
+            the worker could not be started — callers then fall back to a
+            fresh `docker run --rm` per execution.
+        """
+        if cls._worker_base is not None:
+            return cls._worker_base
+
+        base = Path(tempfile.mkdtemp(prefix="codingagent_worker_", dir=_fast_tmpdir()))
+        docker_command = [
+            "docker",
+            "run",
+            "-d",
+            "--rm",
+            "--name",
+            cls.worker_container_name(),
+            f"--volume={base}:{cls.WORKER_MOUNT_POINT}",
+        ]
+        docker_command.extend(cls._cache_mount_args())
+        if os.name == "posix":
+            docker_command.extend(["--user", f"{os.getuid()}:{os.getgid()}"])
+        docker_command.extend([cls.image_name(), "sleep", "infinity"])
+
+        try:
+            # Remove only a stale worker with *this* process's name (a
+            # recycled PID); other runs' workers are never touched.
+            subprocess.run(
+                ["docker", "rm", "-f", cls.worker_container_name()],
+                capture_output=True,
+            )
+            subprocess.run(docker_command, check=True, capture_output=True, text=True)
+        except (subprocess.CalledProcessError, OSError) as e:
+            logging.warning(
+                f"Could not start worker container ({e}); "
+                "falling back to one container per execution."
+            )
+            shutil.rmtree(base, ignore_errors=True)
+            return None
+
+        logging.info(f"Started worker container '{cls.worker_container_name()}'.")
+        cls._worker_base = base
+        atexit.register(cls.shutdown_worker)
+        return base
+
+    @classmethod
+    def shutdown_worker(cls) -> None:
+        """Stops the worker container and removes its base directory."""
+        if cls._worker_base is None:
+            return
+        subprocess.run(
+            ["docker", "rm", "-f", cls.worker_container_name()], capture_output=True
+        )
+        shutil.rmtree(cls._worker_base, ignore_errors=True)
+        cls._worker_base = None
+
     def run(self, timeout: int = 30) -> ExecutionResult:
-        """Runs the command inside the Docker container.
+        """Runs the sandbox's configured command inside the container.
+
+        Args:
+            timeout: The maximum execution time in seconds.
+
+        Returns:
+            An ExecutionResult object with the outcome of the command.
+        """
+        return self.exec(self.command, timeout=timeout)
+
+    def ensure_setup(self, setup_command: str, timeout: int = 300) -> ExecutionResult:
+        """Runs `setup_command` in the workspace, at most once per state.
+
+        Environment setup (venv creation, dependency installs) dominates the
+        cost of an attempt, yet its inputs rarely change between attempts.
+        The command is re-run only when it has not succeeded in this
+        workspace yet or the synced requirements.txt content changed;
+        otherwise a synthetic zero-exit result is returned immediately.
+        """
+        if not self.workspace_path:
+            raise TypeError("ensure_setup() requires an open workspace.")
+
+        requirements = self.workspace_path / "requirements.txt"
+        digest = (
+            hashlib.sha256(requirements.read_bytes()).hexdigest()
+            if requirements.exists()
+            else ""
+        )
+        key = (setup_command, digest)
+        if self._setup_key == key:
+            return ExecutionResult(exit_code=0, stdout="", stderr="")
+
+        result = self.exec(setup_command, timeout=timeout)
+        if result.was_successful:
+            self._setup_key = key
+        return result
+
+    def exec(self, command: str, timeout: int = 30) -> ExecutionResult:
+        """Runs `command` inside the Docker container.
 
         This function runs the container with the same user ID as the host user
         to prevent file permission errors in the mounted volume.
 
         Args:
+            command: The shell command to run from the workspace root.
             timeout: The maximum execution time in seconds.
 
         Returns:
             An ExecutionResult object with the outcome of the command.
         """
         if not self.workspace_path:
-            raise TypeError("run() must be called within a 'with' block.")
+            raise TypeError("exec() must be called within a 'with' block.")
 
         logging.info("--- Starting Execution in Docker Container ---")
-        logging.info(f"Command: {self.command}")
-        host_path = str(self.workspace_path.resolve())
-        container_path = "/app"
+        logging.info(f"Command: {command}")
 
-        docker_command = [
-            "docker",
-            "run",
-            "--rm",
-            f"--volume={host_path}:{container_path}",
-        ]
+        # The deadline is enforced inside the container: killing the docker
+        # CLI on the client side only detaches from a `docker exec`, leaving
+        # the command running in the long-lived worker (burning CPU and
+        # possibly writing into a recycled workspace). coreutils `timeout`
+        # sends TERM at the deadline and escalates to KILL shortly after.
+        guarded_command = (
+            f"timeout --kill-after={self.TIMEOUT_KILL_GRACE_S}s {timeout}s "
+            f"bash -c {shlex.quote(command)}"
+        )
 
-        if os.name == "posix":
-            user_id = os.getuid()
-            group_id = os.getgid()
-            docker_command.extend(["--user", f"{user_id}:{group_id}"])
+        if self._use_worker:
+            # Warm path: the workspace already lives under the worker's
+            # mount, so execution is a `docker exec` with no container start.
+            workspace_in_worker = (
+                f"{self.WORKER_MOUNT_POINT}/{self.workspace_path.name}"
+            )
+            docker_command = [
+                "docker",
+                "exec",
+                self.worker_container_name(),
+                "bash",
+                "-c",
+                f"cd {workspace_in_worker} && {guarded_command}",
+            ]
+        else:
+            host_path = str(self.workspace_path.resolve())
+            container_path = "/app"
+
+            docker_command = [
+                "docker",
+                "run",
+                "--rm",
+                f"--volume={host_path}:{container_path}",
+            ]
+            docker_command.extend(self._cache_mount_args())
+
+            if os.name == "posix":
+                user_id = os.getuid()
+                group_id = os.getgid()
+                docker_command.extend(["--user", f"{user_id}:{group_id}"])
 
-        docker_command.extend([self.DOCKER_IMAGE_NAME, "bash", "-c", self.command])
+            docker_command.extend([self.image_name(), "bash", "-c", guarded_command])
 
+        # Stream both pipes into bounded tails instead of buffering the full
+        # output in memory: long test runs then cost constant memory, and
+        # the tail is what the refinement prompts consume anyway. When log
+        # paths are configured the full output additionally streams to disk
+        # line by line, so verbose runs are preserved without ever being
+        # held (or re-encoded) in RAM as one big string.
+        stdout_tail: deque = deque(maxlen=self.OUTPUT_TAIL_LINES)
+        stderr_tail: deque = deque(maxlen=self.OUTPUT_TAIL_LINES)
+        stdout_sink = (
+            self.stdout_path.open("a", encoding="utf-8")
+            if self.stdout_path
+            else None
+        )
+        stderr_sink = (
+            self.stderr_path.open("a", encoding="utf-8")
+            if self.stderr_path
+            else None
+        )
         try:
-            result = subprocess.run(
-                docker_command, capture_output=True, text=True, timeout=timeout
-            )
-            return ExecutionResult(
-                exit_code=result.returncode, stdout=result.stdout, stderr=result.stderr
-            )
-        except subprocess.TimeoutExpired as e:
-            logging.error("--- DOCKER EXECUTION FAILED: TIMEOUT ---")
-            return ExecutionResult(
-                exit_code=-1,
-                stdout=e.stdout or "",
-                stderr=e.stderr or f"Execution timed out after {timeout} seconds.",
-                timed_out=True,
+            process = subprocess.Popen(
+                docker_command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
             )
         except Exception as e:
             logging.error(f"--- DOCKER EXECUTION FAILED: UNEXPECTED ERROR --- \n{e}")
+            for sink in (stdout_sink, stderr_sink):
+                if sink is not None:
+                    sink.close()
             return ExecutionResult(
                 exit_code=-1, stdout="", stderr=str(e), timed_out=False
             )
 
+        readers = [
+            Thread(
+                target=self._drain, args=(process.stdout, stdout_tail, stdout_sink)
+            ),
+            Thread(
+                target=self._drain, args=(process.stderr, stderr_tail, stderr_sink)
+            ),
+        ]
+        for reader in readers:
+            reader.start()
+
+        timed_out = False
+        try:
+            # The in-container `timeout` enforces the real deadline; the
+            # client-side wait is only a backstop (deadline + grace + slack)
+            # for a wedged docker CLI, since killing it here cannot stop
+            # the command inside the container.
+            exit_code = process.wait(
+                timeout=timeout + self.TIMEOUT_KILL_GRACE_S + 30
+            )
+            if exit_code in (124, 137):
+                # coreutils `timeout` exits 124 when the deadline expired,
+                # or 128+9 when the follow-up KILL was needed.
+                logging.error("--- DOCKER EXECUTION FAILED: TIMEOUT ---")
+                timed_out = True
+        except subprocess.TimeoutExpired:
+            logging.error("--- DOCKER EXECUTION FAILED: TIMEOUT ---")
+            process.kill()
+            process.wait()
+            exit_code = -1
+            timed_out = True
+        for reader in readers:
+            reader.join()
+        for sink in (stdout_sink, stderr_sink):
+            if sink is not None:
+                sink.close()
+
+        stderr = "".join(stderr_tail)
+        if timed_out and not stderr:
+            stderr = f"Execution timed out after {timeout} seconds."
+        return ExecutionResult(
+            exit_code=exit_code,
+            stdout="".join(stdout_tail),
+            stderr=stderr,
+            timed_out=timed_out,
+        )
+
+    @staticmethod
+    def _drain(pipe, tail: deque, sink=None) -> None:
+        """Reads a pipe to exhaustion, keeping only the bounded tail.
+
+        When `sink` is given every line is also appended to it as it
+        arrives, preserving the full output on disk.
+        """
+        with pipe:
+            for line in pipe:
+                tail.append(line)
+                if sink is not None:
+                    sink.write(line)
+
+    @classmethod
+    def image_name(cls) -> str:
+        """Returns the content-addressed tag for the current Dockerfile."""
+        if cls._image_tag is None:
+            cls._create_dockerfile_if_not_exists()
+            digest = hashlib.sha256(Path("Dockerfile").read_bytes()).hexdigest()
+            cls._image_tag = f"{cls.DOCKER_IMAGE_NAME}:{digest[:12]}"
+        return cls._image_tag
+
     @staticmethod
     def setup_image() -> None:
-        """Checks if the Docker image exists and builds it if not."""
+        """Checks if the image for the current Dockerfile exists, builds it if not."""
+        image = DockerSandbox.image_name()
         try:
             subprocess.run(
-                ["docker", "image", "inspect", DockerSandbox.DOCKER_IMAGE_NAME],
+                ["docker", "image", "inspect", image],
                 check=True,
                 capture_output=True,
             )
-            logging.info(
-                f"Docker image '{DockerSandbox.DOCKER_IMAGE_NAME}' already exists."
-            )
+            logging.info(f"Docker image '{image}' already exists.")
         except subprocess.CalledProcessError:
-            logging.warning(
-                f"Docker image '{DockerSandbox.DOCKER_IMAGE_NAME}' not found."
-            )
-            DockerSandbox._create_dockerfile_if_not_exists()
+            logging.warning(f"Docker image '{image}' not found.")
             DockerSandbox._build_docker_image()
 
     @staticmethod
@@ -162,6 +562,10 @@ class DockerSandbox:
                 COPY --from=uv-installer /uv /usr/local/bin/uv
                 COPY --from=uv-installer /uvx /usr/local/bin/uvx
                 RUN python -V && uv --version
+                # Pre-bake the test runner into the system site-packages:
+                # workspace venvs are created with --system-site-packages,
+                # so per-run setup never has to install pytest again.
+                RUN uv pip install --system pytest
                 WORKDIR /app
                 CMD [ "bash" ]
             """)
@@ -170,10 +574,11 @@ class DockerSandbox:
     @staticmethod
     def _build_docker_image() -> None:
         """Builds the Docker image."""
-        logging.info(f"Building Docker image '{DockerSandbox.DOCKER_IMAGE_NAME}'...")
+        image = DockerSandbox.image_name()
+        logging.info(f"Building Docker image '{image}'...")
         try:
             subprocess.run(
-                ["docker", "build", "-t", DockerSandbox.DOCKER_IMAGE_NAME, "."],
+                ["docker", "build", "-t", image, "."],
                 check=True,
                 capture_output=True,
                 text=True,
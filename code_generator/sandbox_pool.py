@@ -0,0 +1,58 @@
+import logging
+from threading import Lock
+from typing import List
+
+from code_generator.sandbox import DockerSandbox
+
+logger = logging.getLogger(__name__)
+
+
+class SandboxPool:
+    """
+    Recycles persistent DockerSandbox instances across executions.
+
+    A fresh sandbox pays workspace creation and, on its first execution,
+    the venv + dependency install; a recycled one keeps both warm (see
+    DockerSandbox.ensure_setup), so repeated attempts skip the dominant
+    per-execution startup cost. `acquire` hands out an idle sandbox or
+    opens a new one — callers are never blocked on a fixed capacity —
+    `release` returns it for reuse, and `prewarm` opens sandboxes ahead
+    of demand so the first attempts of a run find warm ones waiting.
+
+    Thread-safe: attempts race on worker threads and share one pool.
+    """
+
+    def __init__(self, size: int = 0):
+        self._idle: List[DockerSandbox] = []
+        self._lock = Lock()
+        if size:
+            self.prewarm(size)
+
+    def prewarm(self, size: int) -> None:
+        """Opens `size` sandboxes ahead of demand, best-effort."""
+        for _ in range(size):
+            try:
+                sandbox = DockerSandbox.open_persistent()
+            except OSError as e:
+                logger.warning(f"Sandbox pre-warm stopped: {e}")
+                return
+            self.release(sandbox)
+
+    def acquire(self) -> DockerSandbox:
+        """Takes an idle sandbox, opening a new one when none is free."""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return DockerSandbox.open_persistent()
+
+    def release(self, sandbox: DockerSandbox) -> None:
+        """Returns a sandbox to the pool for reuse."""
+        with self._lock:
+            self._idle.append(sandbox)
+
+    def close(self) -> None:
+        """Tears down every idle sandbox."""
+        with self._lock:
+            sandboxes, self._idle = self._idle, []
+        for sandbox in sandboxes:
+            sandbox.close()
@@ -0,0 +1,113 @@
+import json
+import logging
+import math
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticCache:
+    """
+    Embedding-similarity cache for near-duplicate prompts.
+
+    Refinement-loop prompts often differ only in a small error diff while the
+    desired structured output is identical, so exact-key caches miss. This
+    cache embeds each prompt with the provider's embedding model and serves
+    the stored raw response when the cosine similarity to a previously
+    answered prompt exceeds `threshold`. Embeddings are L2-normalized on
+    insert, so similarity reduces to a dot product over a plain list matrix —
+    entry counts here are far too small to justify a vector-index dependency.
+
+    Entries are appended to a JSONL sidecar file and reloaded on init, so
+    hits survive across runs. The embedding call is itself a (cheap) API
+    round-trip; embedding failures degrade to a miss rather than failing the
+    generation.
+    """
+
+    EMBEDDING_MODEL = "text-embedding-004"
+
+    def __init__(
+        self,
+        client,
+        path: Union[Path, str],
+        threshold: float = 0.95,
+    ):
+        """Initializes the cache and reloads persisted entries.
+
+        Args:
+            client: The `genai.Client` used for embedding calls.
+            path: The JSONL file persisting (embedding, response) entries.
+            threshold: Minimum cosine similarity counted as a hit. Kept
+                deliberately high: prompts that are close but not identical
+                (retry loops, successive decisions) must only hit when the
+                difference is provably immaterial.
+        """
+        self.client = client
+        self.path = Path(path)
+        self.threshold = threshold
+        self._embeddings: List[List[float]] = []
+        self._responses: List[str] = []
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        for line in self.path.read_text(encoding="utf-8").splitlines():
+            try:
+                entry = json.loads(line)
+                self._embeddings.append(entry["embedding"])
+                self._responses.append(entry["response"])
+            except (json.JSONDecodeError, KeyError) as e:
+                logger.warning(f"Skipping corrupt semantic cache line: {e}")
+        logger.info(f"Loaded {len(self._responses)} semantic cache entries.")
+
+    def _embed(self, prompt: str) -> Optional[List[float]]:
+        """Returns the L2-normalized embedding of `prompt`, or None on error."""
+        try:
+            result = self.client.models.embed_content(
+                model=self.EMBEDDING_MODEL, contents=prompt
+            )
+            values = list(result.embeddings[0].values)
+        except Exception as e:
+            logger.warning(f"Prompt embedding failed ({e}); semantic cache miss.")
+            return None
+        norm = math.sqrt(sum(v * v for v in values)) or 1.0
+        return [v / norm for v in values]
+
+    def lookup(self, prompt: str) -> Tuple[Optional[List[float]], Optional[str]]:
+        """Looks up the nearest stored prompt by cosine similarity.
+
+        Returns:
+            A (embedding, response) pair. The embedding is the normalized
+            query vector (None if embedding failed) for reuse in a later
+            `put`; the response is the stored raw text of the best match
+            above the threshold, or None on a miss.
+        """
+        query = self._embed(prompt)
+        if query is None or not self._embeddings:
+            return query, None
+
+        best_sim = -1.0
+        best_idx = -1
+        for idx, stored in enumerate(self._embeddings):
+            sim = sum(a * b for a, b in zip(stored, query))
+            if sim > best_sim:
+                best_sim = sim
+                best_idx = idx
+        if best_sim > self.threshold:
+            logger.info(f"Semantic cache hit (similarity {best_sim:.3f}).")
+            return query, self._responses[best_idx]
+        return query, None
+
+    def put(self, embedding: List[float], response: str) -> None:
+        """Stores a normalized embedding with its raw response text."""
+        self._embeddings.append(embedding)
+        self._responses.append(response)
+        try:
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(
+                    json.dumps({"embedding": embedding, "response": response}) + "\n"
+                )
+        except OSError as e:
+            logger.warning(f"Could not persist semantic cache entry: {e}")
@@ -1,9 +1,18 @@
 import argparse
+import difflib
+import functools
+import hashlib
+import io
 import json
 import logging
+import queue
+import tarfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import asdict
+from threading import Event, Thread
 from datetime import datetime
 from pathlib import Path
-from typing import Any, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from dotenv import load_dotenv
 from pydantic import BaseModel
@@ -17,20 +26,51 @@ from code_generator.agents.human_agent import HumanAgent, HumanInput
 from code_generator.agents.orchestrator import (
     OrchestratorAgent,
     OrchestratorInput,
+    OrchestratorOutput,
 )
-from code_generator.llm_interface import LLMInterface
+from code_generator.history import HistoryCompactor, truncate_feedback
+from code_generator.llm_interface import CodeFile, LLMInterface
 from code_generator.sandbox import DockerSandbox, ExecutionResult
+from code_generator.sandbox_pool import SandboxPool
 
 # --- Configuration ---
 MAX_ORCHESTRATOR_STEPS = 25
 MAX_CODE_AGENT_ATTEMPTS = 5
-EXECUTION_COMMAND = (
-    "python3 -m venv .venv && "
+# Setup and test are split so persistent sandboxes pay the venv and
+# dependency install once per workspace (see DockerSandbox.ensure_setup)
+# instead of on every attempt; only the test phase runs per attempt.
+# Installs go through the shared uv cache mounted into every container
+# (see DockerSandbox.UV_CACHE_MOUNT_POINT), so wheels are downloaded and
+# resolved once and reused across attempts, steps and processes. The
+# venv is created by uv (hardlinks, no pip bootstrap) and sees the
+# image's system site-packages, where pytest is pre-baked — only the
+# generated requirements are installed per workspace.
+SETUP_COMMAND = (
+    "uv venv --system-site-packages .venv && "
     ". .venv/bin/activate && "
-    "uv pip install --no-cache -r requirements.txt && "
-    "uv pip install --no-cache -q pytest && "
-    "pytest -p no:cacheprovider -v"
+    "uv pip install -r requirements.txt"
 )
+# `python -m pytest`, not the bare entry point: pytest lives in the
+# system site-packages, so /usr/local/bin/pytest's shebang would launch
+# the system interpreter, which never sees the venv's packages
+# (--system-site-packages is one-directional). The venv python sees both.
+TEST_COMMAND = ". .venv/bin/activate && python -m pytest -p no:cacheprovider -v"
+SETUP_TIMEOUT = 300
+EXECUTION_COMMAND = SETUP_COMMAND + " && " + TEST_COMMAND
+
+
+@functools.lru_cache(maxsize=64)
+def _compose_command(base: str, extra: str) -> str:
+    """Joins a base command with an optional orchestrator-provided suffix.
+
+    The orchestrator re-issues the same handful of extras across steps and
+    attempts; memoizing the join returns the identical composed string
+    instead of reallocating it per call, which also keeps downstream
+    content-hash caches keyed on one interned object.
+    """
+    if extra:
+        return base + " && " + extra
+    return base
 RUNS_DIR = Path("runs")
 
 
@@ -43,17 +83,203 @@ class Checkpoint(BaseModel):
     execution_feedback: Optional[str]
     orchestrator_step: int
 
-    def save(self, path: Path) -> None:
-        """Saves the checkpoint to a file."""
-        with open(path, "w") as f:
-            json.dump(self.model_dump(), f, indent=4)
-
     @classmethod
     def load(cls, path: Path) -> "Checkpoint":
-        """Loads a checkpoint from a file."""
-        with open(path, "r") as f:
-            data = json.load(f)
-        return cls(**data)
+        """Loads a legacy single-file checkpoint.
+
+        Kept so runs recorded before the append-only log (see
+        CheckpointLog) can still be resumed. Validates straight from the
+        raw bytes: a single pass in the model's compiled validator, with
+        no intermediate dict of the full history and code payload.
+        """
+        return cls.model_validate_json(path.read_bytes())
+
+
+class CheckpointManifest(BaseModel):
+    """Content-addressed reference to a CodeAgentOutput.
+
+    File contents live in the run's `objects/` store under their SHA-256;
+    the manifest only maps each relative path to its digest.
+    """
+
+    reasoning: str
+    files: Dict[str, str]
+
+
+class CheckpointRecord(BaseModel):
+    """One line of the append-only checkpoint log."""
+
+    step: int
+    objective: str
+    history_append: List[str]
+    execution_feedback: Optional[str]
+    latest_code: Optional[CheckpointManifest]
+
+
+class CheckpointLog:
+    """
+    Append-only, deduplicated checkpoint persistence for a run.
+
+    Rewriting the full checkpoint every step is O(steps²) bytes total: the
+    history grows monotonically and `latest_code` repeats large file
+    payloads across iterations. The log instead appends one JSONL record
+    per step carrying only the history entries added since the last record
+    and a manifest of content hashes; file contents are written once into
+    `objects/<sha256>` and shared across steps. Recovery replays the log
+    in order, so disk traffic is linear in what actually changed.
+    """
+
+    LOG_NAME = "checkpoint.log"
+    OBJECTS_DIR_NAME = "objects"
+
+    def __init__(self, run_dir: Path):
+        self._log_path = run_dir / self.LOG_NAME
+        self._objects_dir = run_dir / self.OBJECTS_DIR_NAME
+        self._objects_dir.mkdir(parents=True, exist_ok=True)
+        # On resume, count the history entries already on disk so the next
+        # append only carries what came after them.
+        self._written_history = 0
+        if self._log_path.exists():
+            for record in self._iter_records(self._log_path):
+                self._written_history += len(record.history_append)
+        self._handle = self._log_path.open(
+            "a", buffering=1 << 16, encoding="utf-8"
+        )
+
+    @staticmethod
+    def _iter_records(path: Path):
+        with path.open(encoding="utf-8") as handle:
+            for line in handle:
+                if line.strip():
+                    yield CheckpointRecord.model_validate_json(line)
+
+    def _store_object(self, content_bytes: bytes) -> str:
+        """Writes `content_bytes` into the object store, returning its digest."""
+        digest = hashlib.sha256(content_bytes).hexdigest()
+        object_path = self._objects_dir / digest
+        if not object_path.exists():
+            object_path.write_bytes(content_bytes)
+        return digest
+
+    def append(self, checkpoint: Checkpoint) -> None:
+        """Appends the delta between `checkpoint` and what is already logged."""
+        manifest = None
+        if checkpoint.latest_code is not None:
+            manifest = CheckpointManifest(
+                reasoning=checkpoint.latest_code.reasoning,
+                files={
+                    code_file.relative_path: self._store_object(
+                        code_file.content_bytes
+                    )
+                    for code_file in checkpoint.latest_code.files
+                },
+            )
+        record = CheckpointRecord(
+            step=checkpoint.orchestrator_step,
+            objective=checkpoint.objective,
+            history_append=checkpoint.history[self._written_history :],
+            execution_feedback=checkpoint.execution_feedback,
+            latest_code=manifest,
+        )
+        self._handle.write(record.model_dump_json() + "\n")
+        self._handle.flush()
+        self._written_history = len(checkpoint.history)
+
+    def close(self) -> None:
+        self._handle.close()
+
+    @classmethod
+    def load(cls, run_dir: Path) -> Optional[Checkpoint]:
+        """Replays the run's log into the latest Checkpoint state.
+
+        Returns None when the run has no log (e.g. it predates the log
+        format or never completed a step).
+        """
+        log_path = run_dir / cls.LOG_NAME
+        if not log_path.exists():
+            return None
+        history: List[str] = []
+        last: Optional[CheckpointRecord] = None
+        for record in cls._iter_records(log_path):
+            history.extend(record.history_append)
+            last = record
+        if last is None:
+            return None
+
+        latest_code = None
+        if last.latest_code is not None:
+            objects_dir = run_dir / cls.OBJECTS_DIR_NAME
+            latest_code = CodeAgentOutput(
+                reasoning=last.latest_code.reasoning,
+                files=[
+                    CodeFile(
+                        relative_path=relative_path,
+                        content=(objects_dir / digest).read_text(),
+                    )
+                    for relative_path, digest in last.latest_code.files.items()
+                ],
+            )
+        return Checkpoint(
+            objective=last.objective,
+            history=history,
+            latest_code=latest_code,
+            execution_feedback=last.execution_feedback,
+            orchestrator_step=last.step,
+        )
+
+
+class CheckpointWriter:
+    """
+    Persists checkpoints off the main loop, most-recent-wins.
+
+    The main loop hands checkpoints to a single-slot queue serviced by a
+    daemon thread: submitting a new checkpoint while an older one is still
+    waiting discards the stale one, so the loop never blocks on disk and
+    steps that finish faster than a write never queue up redundant writes.
+    Coalescing loses nothing with the delta log: a skipped step's history
+    entries simply ride along in the next record's `history_append`.
+    """
+
+    def __init__(self, log: CheckpointLog):
+        self._log = log
+        self._queue: queue.Queue = queue.Queue(maxsize=1)
+        self._thread = Thread(target=self._drain, daemon=True)
+        self._thread.start()
+
+    def submit(self, checkpoint: Checkpoint) -> None:
+        """Queues `checkpoint`, replacing any not-yet-written predecessor."""
+        try:
+            self._queue.get_nowait()
+            self._queue.task_done()
+        except queue.Empty:
+            pass
+        self._queue.put(checkpoint)
+
+    def close(self) -> None:
+        """Waits for the last submitted checkpoint to hit disk and stops."""
+        self._queue.join()
+        self._queue.put(None)
+        self._thread.join()
+        self._log.close()
+
+    def _drain(self) -> None:
+        while True:
+            checkpoint = self._queue.get()
+            try:
+                if checkpoint is None:
+                    return
+                self._log.append(checkpoint)
+            except OSError as e:
+                logging.warning(f"Checkpoint write failed: {e}")
+            finally:
+                self._queue.task_done()
+
+
+def _manifest_json(payload: Any) -> str:
+    """Serializes an agent payload for the iteration manifest."""
+    if isinstance(payload, BaseModel):
+        return payload.model_dump_json(indent=4)
+    return json.dumps(str(payload))
 
 
 def save_run_artifacts(
@@ -68,59 +294,111 @@ def save_run_artifacts(
     iter_dir = run_dir / f"iteration_{iteration:02d}_{agent_name}"
     iter_dir.mkdir(parents=True, exist_ok=True)
 
-    if isinstance(agent_input, BaseModel):
-        (iter_dir / "agent_input.json").write_text(
-            agent_input.model_dump_json(indent=4)
-        )
-    else:
-        (iter_dir / "agent_input.txt").write_text(str(agent_input))
-
-    if isinstance(agent_output, BaseModel):
-        (iter_dir / "agent_output.json").write_text(
-            agent_output.model_dump_json(indent=4)
-        )
-    else:
-        (iter_dir / "agent_output.txt").write_text(str(agent_output))
+    # One manifest instead of separate input/output/report files: the
+    # models' own JSON is spliced into a single large-buffered stream, so
+    # an iteration costs one open/flush/close cycle instead of one per
+    # artifact. The code archive stays separate — it is binary and large.
+    with (iter_dir / "manifest.json").open(
+        "w", buffering=1 << 20, encoding="utf-8"
+    ) as f:
+        f.write('{\n"input": ')
+        f.write(_manifest_json(agent_input))
+        f.write(',\n"output": ')
+        f.write(_manifest_json(agent_output))
+        if execution_result:
+            f.write(',\n"execution": ')
+            json.dump(asdict(execution_result), f, indent=4)
+        f.write("\n}\n")
 
     if isinstance(agent_output, CodeAgentOutput):
-        code_dir = iter_dir / "code"
-        code_dir.mkdir()
-        for code_file in agent_output.files:
-            file_path = code_dir / code_file.relative_path
-            file_path.parent.mkdir(parents=True, exist_ok=True)
-            file_path.write_text(code_file.content)
-
-    if execution_result:
-        report_content = f"""
---- EXECUTION REPORT ---
-Timed Out: {execution_result.timed_out}
-Exit Code: {execution_result.exit_code}
---- STDOUT ---
-{execution_result.stdout or "No standard output."}
---- STDERR ---
-{execution_result.stderr or "No standard error."}
---- END REPORT ---
-        """
-        (iter_dir / "execution_report.txt").write_text(report_content)
+        # One compressed archive instead of a mkdir + write per file: a
+        # many-file nested tree costs a single output stream and directory
+        # entry rather than several syscalls per file, and compresses well.
+        # Extract with `tar -xzf code.tar.gz`.
+        with tarfile.open(iter_dir / "code.tar.gz", "w:gz", compresslevel=3) as tar:
+            for code_file in agent_output.files:
+                data = code_file.content_bytes
+                info = tarfile.TarInfo(name=code_file.relative_path)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
 
     logging.info(f"Saved artifacts for iteration {iteration} to {iter_dir}")
 
 
+class ArtifactWriter:
+    """Persists run artifacts off the critical path.
+
+    Artifact dumps are pure logging: nothing reads them back during the
+    run, so the main loop only needs to enqueue the payload and move on
+    instead of blocking on the serialization and the many small writes.
+    A single worker drains submissions in FIFO order — the on-disk layout
+    stays exactly as if the writes were synchronous — and `close()`
+    blocks until everything queued has hit disk.
+    """
+
+    def __init__(self):
+        self._pool = ThreadPoolExecutor(max_workers=1)
+
+    def submit(self, *args, **kwargs) -> None:
+        """Queues one `save_run_artifacts` call."""
+        self._pool.submit(self._save, *args, **kwargs)
+
+    @staticmethod
+    def _save(*args, **kwargs) -> None:
+        try:
+            save_run_artifacts(*args, **kwargs)
+        except Exception as e:
+            # Losing a debug artifact must never take down the run.
+            logging.warning(f"Artifact write failed: {e}")
+
+    def close(self) -> None:
+        """Waits for all queued artifact writes to finish."""
+        self._pool.shutdown(wait=True)
+
+
 class Application:
     def __init__(
-        self, objective: Optional[str] = None, resume_from: Optional[str] = None
+        self,
+        objective: Optional[str] = None,
+        resume_from: Optional[str] = None,
+        cache_llm: bool = True,
+        semantic_cache_llm: bool = False,
     ):
         self.objective = objective
         self.resume_from = resume_from
         self.run_dir: Optional[Path] = None
-        self.llm = LLMInterface()
+        # The semantic cache is opt-in, unlike the exact caches: it serves
+        # *near*-duplicate prompts, and the orchestrator's consecutive
+        # decision prompts differ only by a few history lines — close
+        # enough that a default-on fuzzy cache can replay step N's decision
+        # at step N+1 and loop the agent on a stale action.
+        self.llm = LLMInterface(
+            enable_cache=cache_llm, enable_semantic_cache=semantic_cache_llm
+        )
         self.orchestrator: Optional[OrchestratorAgent] = None
-        self.code_agent: Optional[CodeAgent] = None
         self.human_agent: Optional[HumanAgent] = None
         self.history: List[str] = []
         self.latest_code: Optional[CodeAgentOutput] = None
         self.execution_feedback: Optional[str] = None
         self.start_step = 1
+        # Single-worker pool for the speculative next-step orchestrator
+        # call; _next_decision always joins the pending future before any
+        # other use of the orchestrator or compactor, so they are never
+        # driven from two threads at once.
+        self._speculation_pool = ThreadPoolExecutor(max_workers=1)
+        self._pending_decision = None
+        # Persistent sandboxes recycled across attempts and steps so the
+        # venv + dependency install (ensure_setup) amortizes instead of
+        # being repaid per attempt.
+        self._sandbox_pool = SandboxPool()
+        self._image_ready = Event()
+        self._artifact_writer = ArtifactWriter()
+        # File contents as last rendered into a history entry, so later
+        # entries can carry diffs instead of re-embedding full bodies.
+        self._history_files: Dict[str, str] = {}
+        # Successful executions keyed by (file set, command) content hash;
+        # byte-identical regenerations skip the sandbox entirely.
+        self._execution_cache: Dict[str, ExecutionResult] = {}
 
     def _setup_run_dir(self):
         if self.resume_from:
@@ -135,16 +413,25 @@ class Application:
             logging.info(f"Starting new run in directory: {self.run_dir}")
             # Save the objective at the start of a new run
             if self.objective:
-                (self.run_dir / "objective.txt").write_text(self.objective)
+                (self.run_dir / "objective.txt").write_bytes(
+                    self.objective.encode("utf-8")
+                )
 
     def _load_checkpoint(self):
         if not self.resume_from:
             return
 
-        checkpoint_path = self.run_dir / "checkpoint.json"
-        if not checkpoint_path.exists():
+        checkpoint = CheckpointLog.load(self.run_dir)
+        if checkpoint is None:
+            # Runs recorded before the append-only log format keep working.
+            legacy_path = self.run_dir / "checkpoint.json"
+            if legacy_path.exists():
+                logging.info(f"Loading legacy checkpoint from {legacy_path}")
+                checkpoint = Checkpoint.load(legacy_path)
+
+        if checkpoint is None:
             logging.warning(
-                f"No checkpoint.json found in {self.run_dir}. Cannot resume state."
+                f"No checkpoint found in {self.run_dir}. Cannot resume state."
             )
             # Try to load the objective from the original file if checkpoint is missing
             objective_path = self.run_dir / "objective.txt"
@@ -153,8 +440,7 @@ class Application:
                 logging.info("Loaded objective from objective.txt")
             return
 
-        logging.info(f"Loading checkpoint from {checkpoint_path}")
-        checkpoint = Checkpoint.load(checkpoint_path)
+        logging.info(f"Loaded checkpoint state from {self.run_dir}")
         self.objective = checkpoint.objective
         self.history = checkpoint.history
         self.latest_code = checkpoint.latest_code
@@ -169,57 +455,486 @@ class Application:
             "finish": "Ends the process when the task is completed successfully or if you are stuck.",
         }
         self.orchestrator = OrchestratorAgent(self.llm, available_tools=available_tools)
-        self.code_agent = CodeAgent(self.llm)
         self.human_agent = HumanAgent()
+        # One long-lived code agent per run: its files-delta baseline
+        # (last-sent hashes/contents) only pays off when it survives
+        # across refinement calls.
+        self.code_agent = CodeAgent(self.llm)
+        self.history_compactor = HistoryCompactor(self.llm)
+        # Check/build the sandbox image in the background: it overlaps the
+        # first orchestrator call instead of serializing in front of it,
+        # and sandbox acquisition waits on the event before first use.
+        Thread(target=self._prepare_image, daemon=True).start()
 
-    def _handle_code_generation_action(
+    def _prepare_image(self) -> None:
+        try:
+            DockerSandbox.setup_image()
+            self._sandbox_pool.prewarm(MAX_CODE_AGENT_ATTEMPTS)
+        except Exception as e:
+            # Surfacing the failure is the sandbox's job at execution time;
+            # pre-warming must never take down the run on its own.
+            logging.warning(f"Docker image preparation failed: {e}")
+        finally:
+            self._image_ready.set()
+
+    @staticmethod
+    def _build_command(agent_args: Dict[str, Any]) -> str:
+        """Assembles the full logical command (setup + test) shown to the
+        code agent, including the orchestrator's optional extra command."""
+        return _compose_command(EXECUTION_COMMAND, agent_args["command"] or "")
+
+    @staticmethod
+    def _build_test_command(agent_args: Dict[str, Any]) -> str:
+        """Assembles the per-attempt command actually executed in a
+        persistent sandbox; setup runs separately via ensure_setup."""
+        return _compose_command(TEST_COMMAND, agent_args["command"] or "")
+
+    def _acquire_sandbox(self) -> DockerSandbox:
+        """Takes a pooled sandbox once the image is known to be ready."""
+        self._image_ready.wait()
+        return self._sandbox_pool.acquire()
+
+    @staticmethod
+    def _execution_key(files: List[CodeFile], test_command: str) -> str:
+        """Content hash identifying one (file set, command) execution."""
+        digest = hashlib.sha256()
+        for code_file in sorted(files, key=lambda f: f.relative_path):
+            digest.update(code_file.relative_path.encode("utf-8"))
+            digest.update(b"\0")
+            digest.update(code_file.content_bytes)
+            digest.update(b"\0")
+        digest.update(test_command.encode("utf-8"))
+        return digest.hexdigest()
+
+    @staticmethod
+    def _restore_omitted_files(
+        output: CodeAgentOutput, previous: Optional[CodeAgentOutput]
+    ) -> CodeAgentOutput:
+        """Carries files the model omitted over from the previous result.
+
+        Refinement prompts transmit unchanged files as hash markers and tell
+        the model not to re-emit them (the API is stateless, so it could not
+        reproduce their content anyway). The full file set is reassembled
+        here before anything is hashed or executed.
+        """
+        if previous is None:
+            return output
+        present = {code_file.relative_path for code_file in output.files}
+        carried = [
+            code_file
+            for code_file in previous.files
+            if code_file.relative_path not in present
+        ]
+        if not carried:
+            return output
+        return output.model_copy(update={"files": output.files + carried})
+
+    def _run_code_attempts(
         self,
         prompt: str,
         command: str,
+        test_command: str,
         orchestrator_step: int,
+        base_result: Optional[CodeAgentOutput],
+        base_feedback: Optional[str],
+        artifact_tag: str = "",
+        file_scope: Optional[List[str]] = None,
     ) -> Tuple[bool, CodeAgentOutput, Optional[str]]:
-        """Handles the execution of the CodeAgent, including the retry loop."""
-        logging.info("Delegating to CodeAgent...")
-        execution_feedback = self.execution_feedback
+        """Races speculative CodeAgent attempts without touching shared state.
+
+        All attempts are launched concurrently from the same input: the
+        sampler makes each candidate different, and both the LLM call and
+        the sandbox run are I/O-bound, so the wall-clock cost of the retry
+        budget drops from the sum of the attempts to roughly the slowest
+        one. The first attempt whose execution succeeds wins and the queued
+        losers are cancelled. The shared code agent renders the prompt (and
+        advances its files-delta baseline) once up front; the attempts then
+        call the LLM directly with that prompt, so racing never touches the
+        agent's mutable state. Within each attempt the model cascade tries
+        the cheap tier first and escalates only when the sandbox run fails.
 
-        for attempt in range(1, MAX_CODE_AGENT_ATTEMPTS + 1):
+        Keeping this free of `self.latest_code`/`self.execution_feedback`
+        mutations allows several independent code actions to execute
+        concurrently as well.
+        """
+        agent_input = CodeAgentInput(
+            prompt=prompt,
+            command=command,
+            previous_result=base_result,
+            execution_feedback=base_feedback,
+            file_scope=file_scope,
+        )
+        prompt_body, prompt_prefix, prefix_key = self.code_agent.build_parts(
+            agent_input
+        )
+
+        def _one_attempt(
+            attempt: int,
+        ) -> Tuple[int, CodeAgentOutput, ExecutionResult]:
             logging.info(
                 f"--- Code Agent Attempt {attempt}/{MAX_CODE_AGENT_ATTEMPTS} ---"
             )
+            # The sandbox run doubles as the cascade's tester: each tier's
+            # candidate is executed, and the expensive tier is only paid for
+            # when the cheap one fails its tests. `outcome` captures the
+            # merged files and execution result of the last tested
+            # candidate, which is exactly the one the cascade returns.
+            outcome: Dict[str, Any] = {}
 
-            agent_input = CodeAgentInput(
-                prompt=prompt,
-                command=command,
-                previous_result=self.latest_code,
-                execution_feedback=execution_feedback,
-            )
+            def _passes_tests(candidate: CodeAgentOutput) -> bool:
+                agent_output = self._restore_omitted_files(candidate, base_result)
+                # Byte-identical file sets re-emerge across attempts and
+                # across follow-up steps that don't touch the code; a
+                # sandbox run on them is a repeat of a run that already
+                # passed, so serve the recorded result instead of paying
+                # for the container again.
+                key = self._execution_key(agent_output.files, test_command)
+                cached_result = self._execution_cache.get(key)
+                if cached_result is not None:
+                    logging.info(
+                        "Skipping sandbox run: identical files and command "
+                        "already executed successfully."
+                    )
+                    outcome["output"] = agent_output
+                    outcome["result"] = cached_result
+                    return True
+                # Full execution output streams straight into the attempt's
+                # artifact directory; only bounded tails stay in memory.
+                iter_dir = self.run_dir / (
+                    f"iteration_{orchestrator_step:02d}_"
+                    f"code_agent{artifact_tag}_attempt_{attempt}"
+                )
+                iter_dir.mkdir(parents=True, exist_ok=True)
+                sandbox = self._acquire_sandbox()
+                sandbox.stdout_path = iter_dir / "stdout.log"
+                sandbox.stderr_path = iter_dir / "stderr.log"
+                try:
+                    sandbox.sync_files(agent_output.files)
+                    execution_result = sandbox.ensure_setup(
+                        SETUP_COMMAND, timeout=SETUP_TIMEOUT
+                    )
+                    if execution_result.was_successful:
+                        execution_result = sandbox.exec(test_command)
+                finally:
+                    sandbox.stdout_path = None
+                    sandbox.stderr_path = None
+                    self._sandbox_pool.release(sandbox)
+                if execution_result.was_successful:
+                    self._execution_cache[key] = execution_result
+                outcome["output"] = agent_output
+                outcome["result"] = execution_result
+                return execution_result.was_successful
 
-            self.latest_code = self.code_agent.run(agent_input)
+            # Attempt 1 runs unseeded (and so fully cacheable); the rest
+            # carry distinct seeds, otherwise every racer would sample —
+            # or be served from cache — the exact same candidate.
+            self.llm.generate_with_cascade(
+                prompt_body,
+                CodeAgentOutput,
+                tester=_passes_tests,
+                prefix_key=prefix_key,
+                prefix=prompt_prefix,
+                seed=None if attempt == 1 else attempt,
+            )
+            return attempt, outcome["output"], outcome["result"]
 
-            with DockerSandbox(
-                files=self.latest_code.files, command=agent_input.command
-            ) as sandbox:
-                execution_result = sandbox.run()
+        executor = ThreadPoolExecutor(max_workers=MAX_CODE_AGENT_ATTEMPTS)
+        winner: Optional[Tuple[int, CodeAgentOutput, ExecutionResult]] = None
+        losers: List[Tuple[int, CodeAgentOutput, ExecutionResult]] = []
+        last_error: Optional[Exception] = None
+        try:
+            pending = {
+                executor.submit(_one_attempt, attempt)
+                for attempt in range(1, MAX_CODE_AGENT_ATTEMPTS + 1)
+            }
+            while pending and winner is None:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    # One raising candidate must not kill a race another
+                    # candidate may still win; its error only propagates
+                    # if every attempt fails the same way.
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logging.warning(f"Code agent attempt raised: {e}")
+                        last_error = e
+                        continue
+                    if winner is None and result[2].was_successful:
+                        winner = result
+                    else:
+                        losers.append(result)
+        finally:
+            # In-flight losers keep running on their worker threads; we
+            # only stop waiting for them and drop the queued ones.
+            executor.shutdown(wait=False, cancel_futures=True)
 
-            save_run_artifacts(
+        # Winner first, then losers in attempt order, so the artifact
+        # layout stays deterministic regardless of completion order.
+        ordered = ([winner] if winner else []) + sorted(losers)
+        for attempt, agent_output, execution_result in ordered:
+            self._artifact_writer.submit(
                 self.run_dir,
                 orchestrator_step,
-                f"code_agent_attempt_{attempt}",
+                f"code_agent{artifact_tag}_attempt_{attempt}",
                 agent_input,
-                self.latest_code,
+                agent_output,
                 execution_result,
             )
 
-            if execution_result.was_successful:
-                logging.info("✅ Code execution was successful.")
-                return True, self.latest_code, None
-            else:
-                logging.warning(f"❌ Code execution failed on attempt {attempt}.")
-                execution_feedback = f"STDOUT:\n{execution_result.stdout}\n\nSTDERR:\n{execution_result.stderr}"
-                logging.debug(f"Execution feedback:\n{execution_feedback}")
+        if winner is not None:
+            logging.info("✅ Code execution was successful.")
+            return True, winner[1], None
 
         logging.error("Code agent failed to produce working code after all attempts.")
-        return False, self.latest_code, execution_feedback
+        if not losers:
+            # Every attempt raised before producing a candidate; there is
+            # no output to carry forward, so surface the failure itself.
+            raise last_error
+        _, latest_code, execution_result = max(losers)
+        execution_feedback = truncate_feedback(
+            f"STDOUT:\n{execution_result.stdout}\n\n"
+            f"STDERR:\n{execution_result.stderr}"
+        )
+        return False, latest_code, execution_feedback
+
+    def _handle_code_generation_action(
+        self,
+        prompt: str,
+        command: str,
+        test_command: str,
+        orchestrator_step: int,
+        artifact_tag: str = "",
+        file_scope: Optional[List[str]] = None,
+    ) -> Tuple[bool, CodeAgentOutput, Optional[str]]:
+        """Handles the execution of the CodeAgent, including the retry loop."""
+        logging.info("Delegating to CodeAgent...")
+        return self._run_code_attempts(
+            prompt=prompt,
+            command=command,
+            test_command=test_command,
+            orchestrator_step=orchestrator_step,
+            base_result=self.latest_code,
+            base_feedback=self.execution_feedback,
+            artifact_tag=artifact_tag,
+            file_scope=file_scope,
+        )
+
+    def _files_detail(self, latest_code: CodeAgentOutput) -> str:
+        """Renders the generated files for a history entry as deltas.
+
+        Embedding every file body verbatim made history entries — and with
+        them the orchestrator prompt — re-carry unchanged code from old
+        steps. Unchanged files reduce to a marker, changed files to a
+        unified diff against the version last put into history, and new
+        files appear as all-additions diffs.
+        """
+        parts: List[str] = []
+        current: Dict[str, str] = {}
+        for code_file in latest_code.files:
+            current[code_file.relative_path] = code_file.content
+            old = self._history_files.get(code_file.relative_path)
+            if old == code_file.content:
+                parts.append(f"{code_file.relative_path}: unchanged")
+                continue
+            parts.append(
+                "".join(
+                    difflib.unified_diff(
+                        (old or "").splitlines(keepends=True),
+                        code_file.content.splitlines(keepends=True),
+                        fromfile=f"a/{code_file.relative_path}",
+                        tofile=f"b/{code_file.relative_path}",
+                    )
+                )
+            )
+        for removed in self._history_files.keys() - current.keys():
+            parts.append(f"{removed}: removed")
+        self._history_files = current
+        return "\n".join(parts)
+
+    def _execute_action(
+        self,
+        action: OrchestratorOutput,
+        orchestrator_step: int,
+        artifact_tag: str = "",
+    ) -> Tuple[str, bool]:
+        """Executes a single orchestrator action.
+
+        Returns:
+            The history message for the action and whether the main loop
+            should continue afterwards.
+        """
+        agent_name = action.agent_name
+        agent_args = action.args
+
+        if agent_name == "code_agent":
+            was_successful, self.latest_code, self.execution_feedback = (
+                self._handle_code_generation_action(
+                    prompt=agent_args["prompt"],
+                    command=self._build_command(agent_args),
+                    test_command=self._build_test_command(agent_args),
+                    orchestrator_step=orchestrator_step,
+                    artifact_tag=artifact_tag,
+                    file_scope=agent_args.get("file_scope"),
+                )
+            )
+
+            files_detail = self._files_detail(self.latest_code)
+            if was_successful:
+                self.execution_feedback = None  # Reset on success
+                history_message = (
+                    f"Action: code_agent. Result: Code executed successfully.\n"
+                    f"Agent's Reasoning: {self.latest_code.reasoning}\n"
+                    f"Generated Files:\n{files_detail}"
+                )
+            else:
+                history_message = (
+                    f"Action: code_agent. Result: Execution failed after {MAX_CODE_AGENT_ATTEMPTS} attempts.\n"
+                    f"Agent's Final Reasoning: {self.latest_code.reasoning}\n"
+                    f"Final Generated Files:\n{files_detail}\n"
+                    f"Execution Feedback:\n{self.execution_feedback}"
+                )
+            return history_message, True
+
+        elif agent_name == "human_agent":
+            question = agent_args.get(
+                "question", "I need help. What should I do next?"
+            )
+            human_input = HumanInput(question=question)
+            human_output = self.human_agent.run(human_input)
+            self._artifact_writer.submit(
+                self.run_dir,
+                orchestrator_step,
+                f"human_agent{artifact_tag}",
+                human_input,
+                human_output,
+            )
+            return (
+                f"Action: human_agent. Question: {question}. Answer: {human_output.answer}",
+                True,
+            )
+
+        elif agent_name == "finish":
+            reason = agent_args.get("reason", "Task completed.")
+            logging.info(f"🏁 Orchestrator decided to finish. Reason: {reason}")
+            return f"Action: finish. Reason: {reason}", False
+
+        else:
+            logging.error(f"Unknown agent name received: {agent_name}")
+            return "Action: unknown. Result: An internal error occurred.", False
+
+    def _speculate_next_decision(self) -> None:
+        """Dispatches the next orchestrator decision on a background thread.
+
+        The decision for step N+1 only depends on the history as it stands
+        after step N's actions, so it can be co-scheduled with the
+        checkpoint and artifact writes that close the iteration instead of
+        paying its full round-trip at the top of the next one.
+        """
+        history_snapshot = list(self.history)
+
+        def _decide() -> Tuple[OrchestratorInput, OrchestratorOutput]:
+            orchestrator_input = OrchestratorInput(
+                objective=self.objective,
+                history=self.history_compactor.compact(history_snapshot),
+            )
+            return orchestrator_input, self.orchestrator.run(orchestrator_input)
+
+        self._pending_decision = self._speculation_pool.submit(_decide)
+
+    def _next_decision(self) -> Tuple[OrchestratorInput, OrchestratorOutput]:
+        """Returns the orchestrator decision for the current step.
+
+        A speculative decision is only kept when the input it was computed
+        from matches the actual input byte for byte; otherwise it is
+        discarded and the decision is made inline, so speculation can never
+        change behavior, only hide latency.
+        """
+        speculated: Optional[Tuple[OrchestratorInput, OrchestratorOutput]] = None
+        if self._pending_decision is not None:
+            try:
+                speculated = self._pending_decision.result()
+            except Exception as e:
+                logging.warning(
+                    f"Speculative orchestrator call failed ({e}); deciding inline."
+                )
+            self._pending_decision = None
+
+        # The full history is kept (and checkpointed) verbatim; the
+        # orchestrator only sees a bounded view of it.
+        orchestrator_input = OrchestratorInput(
+            objective=self.objective,
+            history=self.history_compactor.compact(self.history),
+        )
+        if speculated is not None and speculated[0] == orchestrator_input:
+            logging.info("Using speculative orchestrator decision.")
+            return orchestrator_input, speculated[1]
+        return orchestrator_input, self.orchestrator.run(orchestrator_input)
+
+    def _execute_code_actions_parallel(
+        self, actions: List[OrchestratorOutput], orchestrator_step: int
+    ) -> List[str]:
+        """Executes independent code_agent actions concurrently.
+
+        Each action gets its own worker thread; the shared code agent is
+        only used for prompt construction, which is lock-protected. When
+        the orchestrator shards the work by giving each action a
+        `file_scope`, every call regenerates just its shard and the file
+        sets are merged by path afterwards (later actions winning on
+        conflicts), so the latency of the batch collapses to that of the
+        slowest action.
+        """
+        logging.info(f"Running {len(actions)} code actions in parallel...")
+
+        def _one_action(
+            indexed_action: Tuple[int, OrchestratorOutput],
+        ) -> Tuple[bool, CodeAgentOutput, Optional[str]]:
+            action_index, action = indexed_action
+            return self._run_code_attempts(
+                prompt=action.args["prompt"],
+                command=self._build_command(action.args),
+                test_command=self._build_test_command(action.args),
+                orchestrator_step=orchestrator_step,
+                base_result=self.latest_code,
+                base_feedback=self.execution_feedback,
+                artifact_tag=f"_action{action_index}",
+                file_scope=action.args.get("file_scope"),
+            )
+
+        with ThreadPoolExecutor(max_workers=len(actions)) as executor:
+            results = list(executor.map(_one_action, enumerate(actions)))
+
+        merged_files = {
+            code_file.relative_path: code_file
+            for code_file in (self.latest_code.files if self.latest_code else [])
+        }
+        history_messages: List[str] = []
+        reasonings: List[str] = []
+        failed_feedback: Optional[str] = None
+
+        for was_successful, output, feedback in results:
+            for code_file in output.files:
+                merged_files[code_file.relative_path] = code_file
+            reasonings.append(output.reasoning)
+            if was_successful:
+                history_messages.append(
+                    f"Action: code_agent (parallel). Result: Code executed successfully.\n"
+                    f"Agent's Reasoning: {output.reasoning}"
+                )
+            else:
+                failed_feedback = feedback
+                history_messages.append(
+                    f"Action: code_agent (parallel). Result: Execution failed after "
+                    f"{MAX_CODE_AGENT_ATTEMPTS} attempts.\n"
+                    f"Agent's Final Reasoning: {output.reasoning}\n"
+                    f"Execution Feedback:\n{feedback}"
+                )
+
+        self.latest_code = CodeAgentOutput(
+            files=list(merged_files.values()),
+            reasoning="\n".join(reasonings),
+        )
+        self.execution_feedback = failed_feedback
+        return history_messages
 
     def run(self):
         """Main application loop."""
@@ -235,20 +950,14 @@ class Application:
             )
             return
 
-        DockerSandbox.setup_image()
-
+        checkpoint_writer = CheckpointWriter(CheckpointLog(self.run_dir))
         try:
             for i in range(self.start_step, MAX_ORCHESTRATOR_STEPS + 1):
                 logging.info(f"--- Orchestrator Step {i}/{MAX_ORCHESTRATOR_STEPS} ---")
 
-                orchestrator_input = OrchestratorInput(
-                    objective=self.objective, history=self.history
-                )
-                orchestrator_output = self.orchestrator.run(orchestrator_input)
-                agent_name = orchestrator_output.agent_name
-                agent_args = orchestrator_output.args
+                orchestrator_input, orchestrator_output = self._next_decision()
 
-                save_run_artifacts(
+                self._artifact_writer.submit(
                     self.run_dir,
                     i,
                     "orchestrator",
@@ -256,66 +965,36 @@ class Application:
                     orchestrator_output,
                 )
 
-                history_message = ""
                 continue_loop = True
+                actions = orchestrator_output.actions
 
-                if agent_name == "code_agent":
-                    prompt = agent_args["prompt"]
-                    command = (
-                        EXECUTION_COMMAND + " && " + agent_args["command"]
-                        if agent_args["command"]
-                        else EXECUTION_COMMAND
+                if orchestrator_output.parallel and all(
+                    action.agent_name == "code_agent" for action in actions
+                ):
+                    self.history.extend(
+                        self._execute_code_actions_parallel(actions, i)
                     )
-
-                    was_successful, self.latest_code, self.execution_feedback = (
-                        self._handle_code_generation_action(
-                            prompt=prompt, command=command, orchestrator_step=i
+                else:
+                    if orchestrator_output.parallel:
+                        logging.warning(
+                            "Parallel execution requested, but only pure "
+                            "code_agent batches run concurrently; executing "
+                            "sequentially."
                         )
-                    )
-
-                    files_detail = self.latest_code.model_dump_json(
-                        include={"files"}, indent=2
-                    )
-                    if was_successful:
-                        self.execution_feedback = None  # Reset on success
-                        history_message = (
-                            f"Action: code_agent. Result: Code executed successfully.\n"
-                            f"Agent's Reasoning: {self.latest_code.reasoning}\n"
-                            f"Generated Files:\n{files_detail}"
+                    multiple_actions = len(actions) > 1
+                    for action_index, action in enumerate(actions):
+                        artifact_tag = (
+                            f"_action{action_index}" if multiple_actions else ""
                         )
-                    else:
-                        history_message = (
-                            f"Action: code_agent. Result: Execution failed after {MAX_CODE_AGENT_ATTEMPTS} attempts.\n"
-                            f"Agent's Final Reasoning: {self.latest_code.reasoning}\n"
-                            f"Final Generated Files:\n{files_detail}\n"
-                            f"Execution Feedback:\n{self.execution_feedback}"
+                        history_message, continue_loop = self._execute_action(
+                            action, i, artifact_tag
                         )
+                        self.history.append(history_message)
+                        if not continue_loop:
+                            break
 
-                elif agent_name == "human_agent":
-                    question = agent_args.get(
-                        "question", "I need help. What should I do next?"
-                    )
-                    human_input = HumanInput(question=question)
-                    human_output = self.human_agent.run(human_input)
-                    save_run_artifacts(
-                        self.run_dir, i, "human_agent", human_input, human_output
-                    )
-                    history_message = f"Action: human_agent. Question: {question}. Answer: {human_output.answer}"
-
-                elif agent_name == "finish":
-                    reason = agent_args.get("reason", "Task completed.")
-                    logging.info(f"🏁 Orchestrator decided to finish. Reason: {reason}")
-                    history_message = f"Action: finish. Reason: {reason}"
-                    continue_loop = False
-
-                else:
-                    logging.error(f"Unknown agent name received: {agent_name}")
-                    history_message = (
-                        "Action: unknown. Result: An internal error occurred."
-                    )
-                    continue_loop = False
-
-                self.history.append(history_message)
+                if continue_loop and i < MAX_ORCHESTRATOR_STEPS:
+                    self._speculate_next_decision()
 
                 # --- Save Checkpoint on Successful Iteration ---
                 checkpoint = Checkpoint(
@@ -325,8 +1004,8 @@ class Application:
                     execution_feedback=self.execution_feedback,
                     orchestrator_step=i,  # The step that just finished
                 )
-                checkpoint.save(self.run_dir / "checkpoint.json")
-                logging.info(f"Saved checkpoint for step {i}.")
+                checkpoint_writer.submit(checkpoint)
+                logging.info(f"Submitted checkpoint for step {i}.")
 
                 if not continue_loop:
                     break
@@ -344,9 +1023,16 @@ class Application:
                 f"To resume, run the script with: --resume_from {self.run_dir}"
             )
             raise  # Re-raise to terminate the program with a non-zero exit code
+        finally:
+            # Drain the writer even on a crash so the last completed step's
+            # checkpoint is on disk for --resume_from.
+            checkpoint_writer.close()
+            self._artifact_writer.close()
+            self._sandbox_pool.close()
 
 
-if __name__ == "__main__":
+def main() -> None:
+    """Parses the CLI arguments and runs the application."""
     parser = argparse.ArgumentParser(
         description="An AI agent that can write and execute code."
     )
@@ -365,6 +1051,27 @@ if __name__ == "__main__":
         type=str,
         help="Path to a previous run directory to resume from.",
     )
+    parser.add_argument(
+        "--cache-llm",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help=(
+            "Serve identical LLM calls from the on-disk response cache. "
+            "Keeps resumed or repeated runs from re-paying calls already "
+            "answered; use --no-cache-llm to force fresh responses."
+        ),
+    )
+    parser.add_argument(
+        "--semantic-cache-llm",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help=(
+            "Also serve near-duplicate LLM calls from the embedding-"
+            "similarity cache. Off by default: close-but-different prompts "
+            "(e.g. successive orchestrator decisions) can be served a "
+            "stale answer, trading behavior for latency."
+        ),
+    )
     args = parser.parse_args()
 
     objective = None
@@ -398,7 +1105,16 @@ if __name__ == "__main__":
         )
         logging.getLogger("google").setLevel(logging.WARNING)
         logging.getLogger("urllib3").setLevel(logging.WARNING)
-        app = Application(objective=objective, resume_from=args.resume_from)
+        app = Application(
+            objective=objective,
+            resume_from=args.resume_from,
+            cache_llm=args.cache_llm,
+            semantic_cache_llm=args.semantic_cache_llm,
+        )
         app.run()
     except Exception:
         raise
+
+
+if __name__ == "__main__":
+    main()